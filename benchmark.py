@@ -0,0 +1,180 @@
+"""CPU inference benchmark with a per-stage breakdown.
+
+Builds SynthesizerTrn from each config with seeded random weights and times
+infer() over a sweep of text lengths, batch sizes and thread counts. Stage
+times come from hooks on enc_p, dp, flow and dec; "path" is the remainder of
+infer() (alignment path generation, prior expansion and noise).
+
+python benchmark.py --output bench.json
+python benchmark.py --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+import torch
+
+import utils
+from models import SynthesizerTrn
+from text.symbols import symbols
+
+
+STAGES = ["enc_p", "dp", "path", "flow", "dec"]
+
+
+def build_model(config_path, seed=1234, freeze=True):
+  hps = utils.get_hparams_from_file(config_path)
+  torch.manual_seed(seed)
+  net_g = SynthesizerTrn(
+      len(symbols),
+      hps.data.filter_length // 2 + 1,
+      hps.train.segment_size // hps.data.hop_length,
+      n_speakers=hps.data.n_speakers,
+      **hps.model)
+  net_g.eval()
+  if freeze:
+    net_g.freeze_for_inference()
+  return net_g, hps
+
+
+class StageTimer():
+  """Accumulates wall time spent inside the given submodules via forward hooks."""
+  def __init__(self, net_g, names=("enc_p", "dp", "flow", "dec")):
+    self.times = {}
+    self._start = {}
+    self._handles = []
+    for name in names:
+      module = getattr(net_g, name)
+      self._handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+      self._handles.append(module.register_forward_hook(self._hook(name)))
+
+  def _pre_hook(self, name):
+    def hook(module, inputs):
+      self._start[name] = time.perf_counter()
+    return hook
+
+  def _hook(self, name):
+    def hook(module, inputs, outputs):
+      self.times[name] = self.times.get(name, 0.) + time.perf_counter() - self._start[name]
+    return hook
+
+  def reset(self):
+    self.times = {}
+
+  def remove(self):
+    for handle in self._handles:
+      handle.remove()
+
+
+def run_case(net_g, hps, length, batch_size, repeats=3, warmup=1, seed=1234):
+  g = torch.Generator().manual_seed(seed)
+  x = torch.randint(1, len(symbols), (batch_size, length), generator=g)
+  x_lengths = torch.LongTensor([length] * batch_size)
+  sid = torch.zeros(batch_size, dtype=torch.long) if net_g.n_speakers > 0 else None
+  timer = StageTimer(net_g)
+  runs = []
+  try:
+    with torch.no_grad():
+      for i in range(warmup + repeats):
+        torch.manual_seed(seed)
+        timer.reset()
+        start = time.perf_counter()
+        _, _, y_mask, _ = net_g.infer(x, x_lengths, sid=sid, noise_scale=.667, noise_scale_w=.8)
+        total = time.perf_counter() - start
+        if i < warmup:
+          continue
+        stages = dict(timer.times)
+        stages["path"] = total - sum(stages.values())
+        runs.append((total, stages))
+  finally:
+    timer.remove()
+  audio_seconds = y_mask.sum().item() * net_g.dec.upsample_factor / hps.data.sampling_rate
+  total = statistics.median(r[0] for r in runs)
+  stages = {k: statistics.median(r[1][k] for r in runs) for k in STAGES}
+  return {
+    "audio_seconds": audio_seconds,
+    "total": total,
+    "rtf": total / audio_seconds,
+    "stages": stages,
+    "stage_rtf": {k: v / audio_seconds for k, v in stages.items()}}
+
+
+def case_key(result):
+  return (result["config"], result["length"], result["batch_size"], result["threads"])
+
+
+def compare(results, baseline, tolerance, min_seconds=1e-3):
+  """Returns a message per (case, stage) that is slower than baseline by more than `tolerance`."""
+  base = {case_key(r): r for r in baseline["results"]}
+  regressions = []
+  for r in results:
+    b = base.get(case_key(r))
+    if b is None:
+      continue
+    pairs = [("total", r["total"], b["total"])] + [(k, r["stages"][k], b["stages"][k]) for k in STAGES]
+    for name, new, old in pairs:
+      # stages in the sub-millisecond range are dominated by timer noise
+      if max(new, old) >= min_seconds and new > old * (1 + tolerance):
+        regressions.append("%s length=%d batch=%d threads=%d %s: %.4fs -> %.4fs (%+.1f%%)" % (
+            r["config"], r["length"], r["batch_size"], r["threads"], name, old, new, 100 * (new / old - 1)))
+  return regressions
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--configs", nargs="+",
+                      default=["configs/ljs_base.json", "configs/ljs_nosdp.json", "configs/vctk_base.json"])
+  parser.add_argument("--lengths", nargs="+", type=int, default=[50, 100, 200], help="phoneme ids per utterance")
+  parser.add_argument("--batch_sizes", nargs="+", type=int, default=[1, 4])
+  parser.add_argument("--threads", nargs="+", type=int, default=[1, 4])
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--warmup", type=int, default=1)
+  parser.add_argument("--no_freeze", action="store_true", help="keep weight norm and the training-only modules")
+  parser.add_argument("--output", type=str, default=None, help="write results as JSON")
+  parser.add_argument("--baseline", type=str, default=None, help="JSON from an earlier run to compare against")
+  parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative slowdown per stage")
+  args = parser.parse_args()
+
+  num_threads = torch.get_num_threads()
+  results = []
+  print("%-22s %6s %5s %7s %8s %7s  %s" % ("config", "length", "batch", "threads", "total", "RTF",
+      "  ".join("%7s" % k for k in STAGES)))
+  for config in args.configs:
+    net_g, hps = build_model(config, freeze=not args.no_freeze)
+    for threads in args.threads:
+      torch.set_num_threads(threads)
+      for batch_size in args.batch_sizes:
+        for length in args.lengths:
+          r = run_case(net_g, hps, length, batch_size, args.repeats, args.warmup)
+          r.update({"config": config, "length": length, "batch_size": batch_size, "threads": threads})
+          results.append(r)
+          print("%-22s %6d %5d %7d %7.3fs %7.4f  %s" % (config, length, batch_size, threads, r["total"], r["rtf"],
+              "  ".join("%6.3fs" % r["stages"][k] for k in STAGES)))
+  torch.set_num_threads(num_threads)
+
+  report = {
+    "meta": {
+      "torch": torch.__version__,
+      "python": platform.python_version(),
+      "machine": platform.machine(),
+      "processor": platform.processor(),
+      "freeze": not args.no_freeze,
+      "repeats": args.repeats},
+    "results": results}
+  if args.output is not None:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+    print("Saved %s" % args.output)
+
+  if args.baseline is not None:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+      print("REGRESSION: %s" % message)
+    if regressions:
+      sys.exit(1)
+    print("No regressions beyond %.0f%% against %s" % (100 * args.tolerance, args.baseline))
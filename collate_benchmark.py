@@ -0,0 +1,66 @@
+"""Times TextAudioCollate with and without recycled buffers on synthetic batches.
+
+Utterance lengths are drawn from a bucket like DistributedBucketSampler's,
+so consecutive batches have similar shapes. Both collates are checked to
+return identical tensors before timing.
+
+python collate_benchmark.py -c configs/ljs_base.json --batch_size 64 --frames 600 800
+"""
+import argparse
+import time
+
+import torch
+
+import utils
+from data_utils import TextAudioCollate
+
+
+def make_batches(hps, batch_size, min_frames, max_frames, n_batches, seed=1234):
+  g = torch.Generator().manual_seed(seed)
+  n_freq = hps.data.filter_length // 2 + 1
+  batches = []
+  for _ in range(n_batches):
+    batch = []
+    for frames in torch.randint(min_frames, max_frames + 1, (batch_size,), generator=g).tolist():
+      text = torch.randint(1, 100, (frames // 6 * (2 if hps.data.add_blank else 1),), generator=g)
+      batch.append((text, torch.rand(n_freq, frames, generator=g),
+                    torch.rand(1, frames * hps.data.hop_length, generator=g), torch.LongTensor([0])))
+    batches.append(batch)
+  return batches
+
+
+def time_collate(collate_fn, batches, repeats):
+  for batch in batches:
+    collate_fn(batch)  # warmup: buffers reach their bucket size
+  start = time.perf_counter()
+  for _ in range(repeats):
+    for batch in batches:
+      collate_fn(batch)
+  return (time.perf_counter() - start) / (repeats * len(batches))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, default="configs/ljs_base.json")
+  parser.add_argument("--batch_size", type=int, default=64)
+  parser.add_argument("--frames", nargs=2, type=int, default=[600, 800], help="bucket range of spectrogram frames")
+  parser.add_argument("--batches", type=int, default=4, help="distinct batches, cycled")
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--buffer_depth", type=int, default=4)
+  parser.add_argument("--pin_memory", action="store_true")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  batches = make_batches(hps, args.batch_size, args.frames[0], args.frames[1], args.batches)
+  baseline = TextAudioCollate()
+  buffered = TextAudioCollate(buffer_depth=args.buffer_depth, pin_memory=args.pin_memory)
+  for batch in batches:
+    for a, b in zip(baseline(batch), buffered(batch)):
+      assert a.shape == b.shape and torch.equal(a, b)
+
+  mb = sum(t.numel() * t.element_size() for t in baseline(batches[0])) / 1024 ** 2
+  t_baseline = time_collate(baseline, batches, args.repeats)
+  t_buffered = time_collate(buffered, batches, args.repeats)
+  print("batch %d x %d-%d frames, %.0f MB per batch" % (args.batch_size, args.frames[0], args.frames[1], mb))
+  print("  TextAudioCollate              %8.2f ms" % (1e3 * t_baseline))
+  print("  TextAudioCollate(buffer_depth=%d) %5.2f ms  (%.2fx)" % (args.buffer_depth, 1e3 * t_buffered, t_baseline / t_buffered))
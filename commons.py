@@ -45,6 +45,32 @@ def rand_gumbel_like(x):
   return g
 
 
+def randn_per_item(like, generators=None, lengths=None, channels=None):
+  """Standard normal noise shaped like `like` [b, c, t] (or with `channels`
+  channels), drawn on its device and dtype.
+
+  With `generators` (one torch.Generator or None per item), item i draws only
+  its first lengths[i] frames from its own generator and the padding stays
+  zero, so its noise does not depend on the rest of the batch.
+  """
+  if channels is None:
+    channels = like.size(1)
+    if generators is None:
+      return torch.randn_like(like)
+  if generators is None:
+    return torch.randn(like.size(0), channels, like.size(2), device=like.device, dtype=like.dtype)
+  noise = torch.zeros(like.size(0), channels, like.size(2), device=like.device, dtype=like.dtype)
+  for i, generator in enumerate(generators):
+    length = like.size(2) if lengths is None else int(lengths[i])
+    noise[i, :, :length] = torch.randn(channels, length, generator=generator, device=like.device, dtype=like.dtype)
+  return noise
+
+
+def make_generators(seeds, device='cpu'):
+  """One seeded torch.Generator per entry of `seeds` (None keeps the global RNG)."""
+  return [None if s is None else torch.Generator(device=device).manual_seed(int(s)) for s in seeds]
+
+
 def slice_segments(x, ids_str, segment_size=4):
   ret = torch.zeros_like(x[:, :, :segment_size])
   for i in range(x.size(0)):
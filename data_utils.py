@@ -1,5 +1,7 @@
 import time
 import os
+import hashlib
+import json
 import random
 import numpy as np
 import torch
@@ -7,8 +9,120 @@ import torch.utils.data
 
 import commons 
 from mel_processing import spectrogram_torch
-from utils import load_wav_to_torch, load_filepaths_and_text
+from utils import load_wav_to_torch, load_filepaths_and_text, save_atomic
 from text import text_to_sequence, cleaned_text_to_sequence
+from manifest import load_manifest, check_files
+
+
+def spec_cache_path(cache_dir, audiopath, hparams):
+    """Where precompute_spec.py stores the spectrogram of `audiopath`.
+
+    Features live under a subdirectory named after the STFT settings, so a
+    config change never reads stale spectrograms. The audio path is mirrored
+    below it, with any leading separator or drive dropped.
+    """
+    settings = "{}_{}_{}_{}".format(hparams.sampling_rate, hparams.filter_length,
+        hparams.hop_length, hparams.win_length)
+    relpath = os.path.splitdrive(os.path.normpath(audiopath))[1].lstrip(os.sep)
+    return os.path.join(cache_dir, settings, os.path.splitext(relpath)[0] + ".spec.npy")
+
+
+def compute_spec(audio_norm, hparams):
+    spec = spectrogram_torch(audio_norm, hparams.filter_length,
+        hparams.sampling_rate, hparams.hop_length, hparams.win_length,
+        center=False)
+    return torch.squeeze(spec, 0)
+
+
+def load_spec(filename, audio_norm, hparams, cache_dir=None, cache_dtype="float32"):
+    """Spectrogram of a wav from the feature cache, computing and caching it on a miss.
+
+    With a cache_dir, features are .npy files (see spec_cache_path); without
+    one, they are .spec.pt files next to the wav as before.
+    """
+    if cache_dir is None:
+        spec_filename = filename.replace(".wav", ".spec.pt")
+        if os.path.exists(spec_filename):
+            return torch.load(spec_filename)
+        spec = compute_spec(audio_norm, hparams)
+        save_atomic(spec_filename, lambda f: torch.save(spec, f))
+        return spec
+    spec_filename = spec_cache_path(cache_dir, filename, hparams)
+    if os.path.exists(spec_filename):
+        return torch.from_numpy(np.array(np.load(spec_filename, mmap_mode="r"), dtype=np.float32))
+    spec = compute_spec(audio_norm, hparams)
+    save_atomic(spec_filename, lambda f: np.save(f, spec.numpy().astype(cache_dtype)))
+    return spec
+
+
+def tokenized_paths(filelist, add_blank):
+    """Symbol ids, offsets and their metadata written by preprocess.py --tokenize next to `filelist`."""
+    prefix = filelist + (".blank" if add_blank else "")
+    return prefix + ".ids.npy", prefix + ".offsets.npy", prefix + ".tokens.json"
+
+
+def filelist_digest(filelist):
+    with open(filelist, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def save_tokenized(filelist, texts, add_blank):
+    """Converts cleaned `texts` to one flat int64 array of symbol ids plus
+    len(texts) + 1 offsets, so the ids of line i are ids[offsets[i]:offsets[i + 1]].
+    The digest of `filelist` as it is now is recorded alongside, so edits made
+    to it afterwards are caught by load_tokenized."""
+    sequences = []
+    for text in texts:
+        text_norm = cleaned_text_to_sequence(text)
+        if add_blank:
+            text_norm = commons.intersperse(text_norm, 0)
+        sequences.append(text_norm)
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(x) for x in sequences])
+    ids = np.fromiter((i for x in sequences for i in x), dtype=np.int64, count=offsets[-1])
+    ids_path, offsets_path, meta_path = tokenized_paths(filelist, add_blank)
+    save_atomic(ids_path, lambda f: np.save(f, ids))
+    save_atomic(offsets_path, lambda f: np.save(f, offsets))
+    # written last: the arrays are only used once their metadata exists
+    meta = {"filelist_sha1": filelist_digest(filelist), "add_blank": add_blank, "lines": len(sequences)}
+    save_atomic(meta_path, lambda f: json.dump(meta, f), mode="w")
+
+
+def remove_tokenized(filelist):
+    """Deletes tokenized arrays of either blank setting, e.g. when `filelist` is rewritten without them."""
+    for add_blank in [False, True]:
+        for path in tokenized_paths(filelist, add_blank):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def load_tokenized(filelist, add_blank, n_lines):
+    """(ids, offsets) for `filelist`, or None when it was not tokenized.
+    ids is a copy-on-write map, so items are views of the file."""
+    ids_path, offsets_path, meta_path = tokenized_paths(filelist, add_blank)
+    if not all(os.path.exists(path) for path in [ids_path, offsets_path, meta_path]):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["filelist_sha1"] != filelist_digest(filelist):
+        raise ValueError("{} changed after it was tokenized, rerun preprocess.py --tokenize".format(filelist))
+    ids = np.load(ids_path, mmap_mode="c")
+    offsets = np.load(offsets_path)
+    if len(offsets) != n_lines + 1 or offsets[-1] != len(ids):
+        raise ValueError("{} does not match {} ({} lines), rerun preprocess.py --tokenize".format(
+            ids_path, filelist, n_lines))
+    return ids, offsets
+
+
+def token_length_limits(hparams):
+    """min_token_len / max_token_len bound the ids the model sees. They default
+    to min_text_len / max_text_len, which count symbols before blanks are
+    interspersed, so both filters keep the same utterances."""
+    min_text_len = getattr(hparams, "min_text_len", 1)
+    max_text_len = getattr(hparams, "max_text_len", 190)
+    if hparams.add_blank:
+        min_text_len, max_text_len = 2 * min_text_len + 1, 2 * max_text_len + 1
+    return getattr(hparams, "min_token_len", min_text_len), getattr(hparams, "max_token_len", max_text_len)
 
 
 class TextAudioLoader(torch.utils.data.Dataset):
@@ -19,6 +133,12 @@ class TextAudioLoader(torch.utils.data.Dataset):
     """
     def __init__(self, audiopaths_and_text, hparams):
         self.audiopaths_and_text = load_filepaths_and_text(audiopaths_and_text)
+        # written by manifest.py; None falls back to estimating lengths from file sizes
+        self.manifest = load_manifest(audiopaths_and_text)
+        # re-read headers and compare CRC32s at startup; off keeps startup free of file reads
+        self.verify_manifest = getattr(hparams, "verify_manifest", False)
+        # written by preprocess.py --tokenize; None converts text per item
+        self.tokens = load_tokenized(audiopaths_and_text, hparams.add_blank, len(self.audiopaths_and_text))
         self.text_cleaners  = hparams.text_cleaners
         self.max_wav_value  = hparams.max_wav_value
         self.sampling_rate  = hparams.sampling_rate
@@ -28,13 +148,19 @@ class TextAudioLoader(torch.utils.data.Dataset):
         self.sampling_rate  = hparams.sampling_rate 
 
         self.cleaned_text = getattr(hparams, "cleaned_text", False)
+        self.spec_cache_dir = getattr(hparams, "spec_cache_dir", None)
+        self.spec_cache_dtype = getattr(hparams, "spec_cache_dtype", "float32")
 
         self.add_blank = hparams.add_blank
         self.min_text_len = getattr(hparams, "min_text_len", 1)
         self.max_text_len = getattr(hparams, "max_text_len", 190)
+        self.min_token_len, self.max_token_len = token_length_limits(hparams)
 
         random.seed(1234)
-        random.shuffle(self.audiopaths_and_text)
+        # shuffling indices permutes exactly like shuffling the rows
+        self.token_rows = list(range(len(self.audiopaths_and_text)))
+        random.shuffle(self.token_rows)
+        self.audiopaths_and_text = [self.audiopaths_and_text[i] for i in self.token_rows]
         self._filter()
 
 
@@ -43,22 +169,35 @@ class TextAudioLoader(torch.utils.data.Dataset):
         Filter text & store spec lengths
         """
         # Store spectrogram lengths for Bucketing
-        # wav_length ~= file_size / (wav_channels * Bytes per dim) = file_size / (1 * 2)
-        # spec_length = wav_length // hop_length
+        # with a manifest, spec_length = wav_length // hop_length exactly (center=False)
+        # otherwise wav_length ~= file_size / (wav_channels * Bytes per dim) = file_size / (1 * 2)
 
         audiopaths_and_text_new = []
         lengths = []
-        for audiopath, text in self.audiopaths_and_text:
-            if self.min_text_len <= len(text) and len(text) <= self.max_text_len:
+        token_rows = []
+        for (audiopath, text), row in zip(self.audiopaths_and_text, self.token_rows):
+            if self.tokens is None:
+                keep = self.min_text_len <= len(text) and len(text) <= self.max_text_len
+            else:
+                # exact model input length, blanks included
+                n_tokens = self.tokens[1][row + 1] - self.tokens[1][row]
+                keep = self.min_token_len <= n_tokens and n_tokens <= self.max_token_len
+            if keep:
                 audiopaths_and_text_new.append([audiopath, text])
-                lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
+                token_rows.append(row)
+                if self.manifest is None:
+                    lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
         self.audiopaths_and_text = audiopaths_and_text_new
+        self.token_rows = token_rows
+        if self.manifest is not None:
+            lengths = [n // self.hop_length for n in check_files(
+                [x[0] for x in self.audiopaths_and_text], self.manifest, self, self.verify_manifest)]
         self.lengths = lengths
 
-    def get_audio_text_pair(self, audiopath_and_text):
+    def get_audio_text_pair(self, audiopath_and_text, token_row=None):
         # separate filename and text
         audiopath, text = audiopath_and_text[0], audiopath_and_text[1]
-        text = self.get_text(text)
+        text = self.get_text(text, token_row)
         spec, wav = self.get_audio(audiopath)
         return (text, spec, wav)
 
@@ -69,18 +208,13 @@ class TextAudioLoader(torch.utils.data.Dataset):
                 sampling_rate, self.sampling_rate))
         audio_norm = audio / self.max_wav_value
         audio_norm = audio_norm.unsqueeze(0)
-        spec_filename = filename.replace(".wav", ".spec.pt")
-        if os.path.exists(spec_filename):
-            spec = torch.load(spec_filename)
-        else:
-            spec = spectrogram_torch(audio_norm, self.filter_length,
-                self.sampling_rate, self.hop_length, self.win_length,
-                center=False)
-            spec = torch.squeeze(spec, 0)
-            torch.save(spec, spec_filename)
+        spec = load_spec(filename, audio_norm, self, self.spec_cache_dir, self.spec_cache_dtype)
         return spec, audio_norm
 
-    def get_text(self, text):
+    def get_text(self, text, token_row=None):
+        if token_row is not None and self.tokens is not None:
+            ids, offsets = self.tokens
+            return torch.from_numpy(ids[offsets[token_row]:offsets[token_row + 1]])
         if self.cleaned_text:
             text_norm = cleaned_text_to_sequence(text)
         else:
@@ -91,17 +225,75 @@ class TextAudioLoader(torch.utils.data.Dataset):
         return text_norm
 
     def __getitem__(self, index):
-        return self.get_audio_text_pair(self.audiopaths_and_text[index])
+        return self.get_audio_text_pair(self.audiopaths_and_text[index], self.token_rows[index])
 
     def __len__(self):
         return len(self.audiopaths_and_text)
 
 
+class CollateBuffers():
+    """
+        Recycled output buffers for TextAudioCollate / TextAudioSpeakerCollate.
+        Each padded tensor has `depth` flat buffers used round robin and grown
+        (with headroom) when a batch needs more room, so once the longest
+        buckets have been seen, collating allocates nothing and only the
+        padding is zeroed. A batch is a contiguous view of its buffers: it must
+        be consumed (moved to the GPU, or copied by the DataLoader's
+        pin_memory thread) before `depth` more batches are collated in the
+        same process. In a DataLoader worker the buffers move to shared memory
+        when the first batch is sent, and later batches pass by handle.
+        pin_memory pins the buffers, which only helps when collating in the
+        main process (num_workers=0); workers cannot use CUDA.
+    """
+    def __init__(self, depth=4, pin_memory=False):
+        self.depth = depth
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.buffers = {}
+        self.step = 0
+
+    def get(self, name, shape, dtype):
+        slots = self.buffers.setdefault(name, [None] * self.depth)
+        slot = self.step % self.depth
+        numel = int(np.prod(shape))
+        if slots[slot] is None or slots[slot].numel() < numel or slots[slot].dtype != dtype:
+            slots[slot] = torch.empty(numel + numel // 4, dtype=dtype, pin_memory=self.pin_memory)
+        return slots[slot][:numel].view(shape)
+
+    def collate(self, batch):
+        """text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths,
+        sid (None without a 4th field), ids_sorted_decreasing"""
+        self.step += 1
+        n = len(batch)
+        text_lengths, spec_lengths, wav_lengths = torch.LongTensor(
+            [[x[0].size(0), x[1].size(1), x[2].size(1)] for x in batch]).t()
+        spec_lengths, ids_sorted_decreasing = torch.sort(spec_lengths, dim=0, descending=True)
+        text_lengths = text_lengths[ids_sorted_decreasing]
+        wav_lengths = wav_lengths[ids_sorted_decreasing]
+        order = ids_sorted_decreasing.tolist()
+
+        text_padded = self.get("text", (n, int(text_lengths.max())), torch.long)
+        spec_padded = self.get("spec", (n, batch[0][1].size(0), int(spec_lengths[0])), torch.float)
+        wav_padded = self.get("wav", (n, 1, int(wav_lengths.max())), torch.float)
+        for out, field in [(text_padded, 0), (spec_padded, 1), (wav_padded, 2)]:
+            for i, j in enumerate(order):
+                x = batch[j][field]
+                length = x.size(-1)
+                out[i, ..., :length].copy_(x)
+                if length < out.size(-1):
+                    out[i, ..., length:].zero_()
+        sid = None
+        if len(batch[0]) > 3:
+            sid = torch.LongTensor([int(batch[j][3]) for j in order])
+        return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid, ids_sorted_decreasing
+
+
 class TextAudioCollate():
     """ Zero-pads model inputs and targets
     """
-    def __init__(self, return_ids=False):
+    def __init__(self, return_ids=False, buffer_depth=0, pin_memory=False):
         self.return_ids = return_ids
+        # opt-in recycled output buffers, see CollateBuffers
+        self.buffers = CollateBuffers(buffer_depth, pin_memory) if buffer_depth > 0 else None
 
     def __call__(self, batch):
         """Collate's training batch from normalized text and aduio
@@ -109,6 +301,13 @@ class TextAudioCollate():
         ------
         batch: [text_normalized, spec_normalized, wav_normalized]
         """
+        if self.buffers is not None:
+            text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, _, ids_sorted_decreasing = \
+                self.buffers.collate(batch)
+            if self.return_ids:
+                return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, ids_sorted_decreasing
+            return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths
+
         # Right zero-pad all one-hot text sequences to max input length
         _, ids_sorted_decreasing = torch.sort(
             torch.LongTensor([x[1].size(1) for x in batch]),
@@ -157,6 +356,12 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
     """
     def __init__(self, audiopaths_sid_text, hparams):
         self.audiopaths_sid_text = load_filepaths_and_text(audiopaths_sid_text)
+        # written by manifest.py; None falls back to estimating lengths from file sizes
+        self.manifest = load_manifest(audiopaths_sid_text)
+        # re-read headers and compare CRC32s at startup; off keeps startup free of file reads
+        self.verify_manifest = getattr(hparams, "verify_manifest", False)
+        # written by preprocess.py --tokenize; None converts text per item
+        self.tokens = load_tokenized(audiopaths_sid_text, hparams.add_blank, len(self.audiopaths_sid_text))
         self.text_cleaners = hparams.text_cleaners
         self.max_wav_value = hparams.max_wav_value
         self.sampling_rate = hparams.sampling_rate
@@ -166,13 +371,19 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         self.sampling_rate  = hparams.sampling_rate
 
         self.cleaned_text = getattr(hparams, "cleaned_text", False)
+        self.spec_cache_dir = getattr(hparams, "spec_cache_dir", None)
+        self.spec_cache_dtype = getattr(hparams, "spec_cache_dtype", "float32")
 
         self.add_blank = hparams.add_blank
         self.min_text_len = getattr(hparams, "min_text_len", 1)
         self.max_text_len = getattr(hparams, "max_text_len", 190)
+        self.min_token_len, self.max_token_len = token_length_limits(hparams)
 
         random.seed(1234)
-        random.shuffle(self.audiopaths_sid_text)
+        # shuffling indices permutes exactly like shuffling the rows
+        self.token_rows = list(range(len(self.audiopaths_sid_text)))
+        random.shuffle(self.token_rows)
+        self.audiopaths_sid_text = [self.audiopaths_sid_text[i] for i in self.token_rows]
         self._filter()
 
     def _filter(self):
@@ -180,22 +391,35 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         Filter text & store spec lengths
         """
         # Store spectrogram lengths for Bucketing
-        # wav_length ~= file_size / (wav_channels * Bytes per dim) = file_size / (1 * 2)
-        # spec_length = wav_length // hop_length
+        # with a manifest, spec_length = wav_length // hop_length exactly (center=False)
+        # otherwise wav_length ~= file_size / (wav_channels * Bytes per dim) = file_size / (1 * 2)
 
         audiopaths_sid_text_new = []
         lengths = []
-        for audiopath, sid, text in self.audiopaths_sid_text:
-            if self.min_text_len <= len(text) and len(text) <= self.max_text_len:
+        token_rows = []
+        for (audiopath, sid, text), row in zip(self.audiopaths_sid_text, self.token_rows):
+            if self.tokens is None:
+                keep = self.min_text_len <= len(text) and len(text) <= self.max_text_len
+            else:
+                # exact model input length, blanks included
+                n_tokens = self.tokens[1][row + 1] - self.tokens[1][row]
+                keep = self.min_token_len <= n_tokens and n_tokens <= self.max_token_len
+            if keep:
                 audiopaths_sid_text_new.append([audiopath, sid, text])
-                lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
+                token_rows.append(row)
+                if self.manifest is None:
+                    lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
         self.audiopaths_sid_text = audiopaths_sid_text_new
+        self.token_rows = token_rows
+        if self.manifest is not None:
+            lengths = [n // self.hop_length for n in check_files(
+                [x[0] for x in self.audiopaths_sid_text], self.manifest, self, self.verify_manifest)]
         self.lengths = lengths
 
-    def get_audio_text_speaker_pair(self, audiopath_sid_text):
+    def get_audio_text_speaker_pair(self, audiopath_sid_text, token_row=None):
         # separate filename, speaker_id and text
         audiopath, sid, text = audiopath_sid_text[0], audiopath_sid_text[1], audiopath_sid_text[2]
-        text = self.get_text(text)
+        text = self.get_text(text, token_row)
         spec, wav = self.get_audio(audiopath)
         sid = self.get_sid(sid)
         return (text, spec, wav, sid)
@@ -207,18 +431,13 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
                 sampling_rate, self.sampling_rate))
         audio_norm = audio / self.max_wav_value
         audio_norm = audio_norm.unsqueeze(0)
-        spec_filename = filename.replace(".wav", ".spec.pt")
-        if os.path.exists(spec_filename):
-            spec = torch.load(spec_filename)
-        else:
-            spec = spectrogram_torch(audio_norm, self.filter_length,
-                self.sampling_rate, self.hop_length, self.win_length,
-                center=False)
-            spec = torch.squeeze(spec, 0)
-            torch.save(spec, spec_filename)
+        spec = load_spec(filename, audio_norm, self, self.spec_cache_dir, self.spec_cache_dtype)
         return spec, audio_norm
 
-    def get_text(self, text):
+    def get_text(self, text, token_row=None):
+        if token_row is not None and self.tokens is not None:
+            ids, offsets = self.tokens
+            return torch.from_numpy(ids[offsets[token_row]:offsets[token_row + 1]])
         if self.cleaned_text:
             text_norm = cleaned_text_to_sequence(text)
         else:
@@ -233,7 +452,7 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         return sid
 
     def __getitem__(self, index):
-        return self.get_audio_text_speaker_pair(self.audiopaths_sid_text[index])
+        return self.get_audio_text_speaker_pair(self.audiopaths_sid_text[index], self.token_rows[index])
 
     def __len__(self):
         return len(self.audiopaths_sid_text)
@@ -242,8 +461,10 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
 class TextAudioSpeakerCollate():
     """ Zero-pads model inputs and targets
     """
-    def __init__(self, return_ids=False):
+    def __init__(self, return_ids=False, buffer_depth=0, pin_memory=False):
         self.return_ids = return_ids
+        # opt-in recycled output buffers, see CollateBuffers
+        self.buffers = CollateBuffers(buffer_depth, pin_memory) if buffer_depth > 0 else None
 
     def __call__(self, batch):
         """Collate's training batch from normalized text, audio and speaker identities
@@ -251,6 +472,13 @@ class TextAudioSpeakerCollate():
         ------
         batch: [text_normalized, spec_normalized, wav_normalized, sid]
         """
+        if self.buffers is not None:
+            text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid, ids_sorted_decreasing = \
+                self.buffers.collate(batch)
+            if self.return_ids:
+                return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid, ids_sorted_decreasing
+            return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid
+
         # Right zero-pad all one-hot text sequences to max input length
         _, ids_sorted_decreasing = torch.sort(
             torch.LongTensor([x[1].size(1) for x in batch]),
@@ -293,6 +521,94 @@ class TextAudioSpeakerCollate():
         return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid
 
 
+# Packed shards written by pack_dataset.py
+PACKED_INDEX_COLUMNS = ["audio_offset", "audio_length", "spec_offset", "spec_frames",
+                        "text_offset", "text_length", "sid", "text_chars"]
+
+
+class PackedTextAudioLoader(torch.utils.data.Dataset):
+    """
+        Drop-in for TextAudioLoader over a directory written by pack_dataset.py.
+        Shards are memory-mapped lazily in each worker process; spectrograms
+        (float32 packs) and token ids are returned as views of the map, and
+        audio is scaled from its int16 view. lengths are exact frame counts.
+    """
+    def __init__(self, packed_dir, hparams):
+        self.packed_dir = packed_dir
+        with open(os.path.join(packed_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        for key in ["sampling_rate", "filter_length", "hop_length", "win_length", "add_blank"]:
+            if self.meta[key] != getattr(hparams, key):
+                raise ValueError("{} was packed with {}={}, config has {}".format(
+                    packed_dir, key, self.meta[key], getattr(hparams, key)))
+        self.max_wav_value = hparams.max_wav_value
+        self.min_token_len, self.max_token_len = token_length_limits(hparams)
+        self._shards = None
+
+        # (shard, row) per item, filtered on the token length like tokenized filelists
+        items = []
+        lengths = []
+        for k, shard in enumerate(self.meta["shards"]):
+            index = np.load(os.path.join(packed_dir, shard, "index.npy"))
+            keep = (index[:, 5] >= self.min_token_len) & (index[:, 5] <= self.max_token_len)
+            for row in np.nonzero(keep)[0]:
+                items.append((k, int(row)))
+            lengths.extend(index[keep, 3].tolist())
+        random.seed(1234)
+        order = list(range(len(items)))
+        random.shuffle(order)
+        self.items = [items[i] for i in order]
+        self.lengths = [lengths[i] for i in order]
+
+    def _open(self):
+        shards = []
+        for shard in self.meta["shards"]:
+            d = os.path.join(self.packed_dir, shard)
+            shards.append({
+                "index": np.load(os.path.join(d, "index.npy")),
+                # copy-on-write maps: writable for torch.from_numpy, never written back
+                "audio": np.memmap(os.path.join(d, "audio.bin"), dtype=np.int16, mode="c"),
+                "spec": np.memmap(os.path.join(d, "spec.bin"), dtype=self.meta["spec_dtype"], mode="c"),
+                "text": np.memmap(os.path.join(d, "text.bin"), dtype=np.int64, mode="c")})
+        return shards
+
+    def __getstate__(self):
+        # DataLoader workers map the shards themselves instead of pickling them
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def get_item(self, index):
+        if self._shards is None:
+            self._shards = self._open()
+        k, row = self.items[index]
+        shard = self._shards[k]
+        audio_offset, audio_length, spec_offset, spec_frames, text_offset, text_length, sid, _ = shard["index"][row]
+        n_freq = self.meta["n_freq"]
+        text = torch.from_numpy(shard["text"][text_offset:text_offset + text_length])
+        spec = torch.from_numpy(shard["spec"][spec_offset:spec_offset + n_freq * spec_frames]).view(n_freq, spec_frames)
+        if spec.dtype != torch.float32:
+            spec = spec.float()
+        wav = torch.from_numpy(shard["audio"][audio_offset:audio_offset + audio_length]).unsqueeze(0)
+        wav = wav.float() / self.max_wav_value
+        return text, spec, wav, int(sid)
+
+    def __getitem__(self, index):
+        return self.get_item(index)[:3]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class PackedTextAudioSpeakerLoader(PackedTextAudioLoader):
+    """
+        Drop-in for TextAudioSpeakerLoader over a directory written by pack_dataset.py.
+    """
+    def __getitem__(self, index):
+        text, spec, wav, sid = self.get_item(index)
+        return text, spec, wav, torch.LongTensor([sid])
+
+
 class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
     """
     Maintain similar input lengths in a batch.
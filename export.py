@@ -0,0 +1,132 @@
+"""Exports the text-to-waveform path of SynthesizerTrn to ONNX and TorchScript.
+
+The exported graph runs enc_p -> dp (reverse) -> path expansion -> flow
+(reverse) -> dec on a single utterance, with dynamic text and output lengths.
+Inputs are x [1, t_x] (int64), x_lengths [1] (int64), scales [3] (float32:
+noise_scale, length_scale, noise_scale_w) and, for multi-speaker models,
+sid [1] (int64). The output is the waveform [1, 1, t].
+
+python export.py -c configs/ljs_base.json -m /path/to/pretrained_ljs.pth -o ljs_base --check
+"""
+import argparse
+import inspect
+import warnings
+
+import torch
+from torch import nn
+
+from inference import load_model
+from text.symbols import symbols
+
+
+class SynthesizerExport(nn.Module):
+  """Wraps a frozen SynthesizerTrn so infer() only takes tensor inputs."""
+  def __init__(self, net_g):
+    super().__init__()
+    self.net_g = net_g
+
+  def forward(self, x, x_lengths, scales, sid=None):
+    o = self.net_g.infer(x, x_lengths, sid=sid,
+        noise_scale=scales[0], length_scale=scales[1], noise_scale_w=scales[2])[0]
+    return o
+
+
+def example_inputs(net_g, length, scales=(.667, 1., .8), seed=1234):
+  g = torch.Generator().manual_seed(seed)
+  x = torch.randint(1, len(symbols), (1, length), generator=g)
+  inputs = (x, torch.LongTensor([length]), torch.FloatTensor(scales))
+  if net_g.n_speakers > 0:
+    inputs = inputs + (torch.LongTensor([0]),)
+  return inputs
+
+
+def trace(model, inputs):
+  # TracerWarnings come from shape asserts in attentions/transforms; they do not affect the graph
+  with warnings.catch_warnings():
+    warnings.simplefilter("ignore", torch.jit.TracerWarning)
+    return torch.jit.trace(model, inputs, check_trace=False)
+
+
+def export_torchscript(model, inputs, path):
+  traced = trace(model, inputs)
+  if hasattr(torch.jit, "freeze"):
+    traced = torch.jit.freeze(traced)
+  torch.jit.save(traced, path)
+  return traced
+
+
+def export_onnx(model, inputs, path, opset_version=13):
+  input_names = ["x", "x_lengths", "scales", "sid"][:len(inputs)]
+  kwargs = {}
+  if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+    kwargs["dynamo"] = False
+  with warnings.catch_warnings():
+    warnings.simplefilter("ignore", torch.jit.TracerWarning)
+    torch.onnx.export(model, inputs, path,
+        input_names=input_names,
+        output_names=["y"],
+        dynamic_axes={"x": {1: "t_x"}, "y": {2: "t_y"}},
+        opset_version=opset_version,
+        **kwargs)
+
+
+def check_parity(model, traced, onnx_path=None, lengths=(3, 17, 64, 160), atol=1e-4):
+  """Compares exported waveforms against SynthesizerTrn.infer on CPU.
+
+  TorchScript draws noise from torch's global RNG like the eager model, so it
+  is compared with noise under a fixed seed. onnxruntime has its own RNG, so
+  the ONNX graph is compared with zero noise, which makes it deterministic.
+  """
+  session = None
+  if onnx_path is not None:
+    import onnxruntime
+    session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+  with torch.no_grad():
+    for length in lengths:
+      inputs = example_inputs(model.net_g, length, seed=length)
+      torch.manual_seed(length)
+      o = model(*inputs)
+      torch.manual_seed(length)
+      o_traced = traced(*inputs)
+      assert o.shape == o_traced.shape, "TorchScript output %s != %s" % (tuple(o_traced.shape), tuple(o.shape))
+      diff = (o - o_traced).abs().max().item()
+      assert diff <= atol, "TorchScript deviates by %.3e" % diff
+      print("length %d: %d samples, TorchScript max abs diff %.3e" % (length, o.size(2), diff))
+      if session is None:
+        continue
+      inputs = example_inputs(model.net_g, length, scales=(0., 1., 0.), seed=length)
+      o = model(*inputs)
+      o_onnx = session.run(None, {i.name: t.numpy() for i, t in zip(session.get_inputs(), inputs)})[0]
+      assert o.shape == o_onnx.shape, "ONNX output %s != %s" % (o_onnx.shape, tuple(o.shape))
+      diff = abs(o.numpy() - o_onnx).max()
+      assert diff <= atol, "ONNX deviates by %.3e" % diff
+      print("length %d: %d samples, ONNX max abs diff %.3e (zero noise)" % (length, o.size(2), diff))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, required=True, help="JSON file for configuration")
+  parser.add_argument("-m", "--model", type=str, required=True, help="Generator checkpoint (G_*.pth)")
+  parser.add_argument("-o", "--output", type=str, required=True, help="output prefix; writes <prefix>.onnx and <prefix>.pt")
+  parser.add_argument("--formats", nargs="+", default=["onnx", "torchscript"], choices=["onnx", "torchscript"])
+  parser.add_argument("--opset", type=int, default=13)
+  parser.add_argument("--check", action="store_true", help="compare exported waveforms against infer() on CPU")
+  args = parser.parse_args()
+
+  net_g, hps = load_model(args.config, args.model)
+  net_g.freeze_for_inference()
+  # export() may toggle training mode on the module it is given; keep it in eval
+  model = SynthesizerExport(net_g).eval()
+  inputs = example_inputs(net_g, 50)
+
+  traced = None
+  onnx_path = None
+  if "torchscript" in args.formats:
+    traced = export_torchscript(model, inputs, args.output + ".pt")
+    print("Saved %s.pt" % args.output)
+  if "onnx" in args.formats:
+    onnx_path = args.output + ".onnx"
+    export_onnx(model, inputs, onnx_path, args.opset)
+    print("Saved %s" % onnx_path)
+  if args.check:
+    check_parity(model, traced if traced is not None else trace(model, inputs), onnx_path)
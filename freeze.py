@@ -0,0 +1,83 @@
+"""Exports a slim inference checkpoint from a training G_*.pth.
+
+The exported checkpoint has weight norm folded into the conv weights, no
+posterior encoder, no duration-predictor posterior and no optimizer state.
+utils.load_checkpoint recognizes it and freezes the target model to match.
+
+With --format mmap the checkpoint is written as a JSON header (config
+included) followed by aligned raw tensors; it loads through a memory map
+without unpickling, and inference.load_model accepts it without a config.
+
+python freeze.py -c configs/ljs_base.json -m logs/ljs_base/G_100000.pth -o ljs_base.pth --check
+python freeze.py -c configs/ljs_base.json -m logs/ljs_base/G_100000.pth -o ljs_base.vits --format mmap
+"""
+import argparse
+import json
+import os
+
+import torch
+
+import utils
+from benchmark import build_model
+from inference import load_model
+from text.symbols import symbols
+
+
+def check_parity(net_g, frozen_g, lengths=(16, 64, 160), seed=1234, atol=1e-4):
+  """Compares infer() waveforms of the original and frozen models on random phoneme ids."""
+  g = torch.Generator().manual_seed(seed)
+  max_diff = 0.
+  with torch.no_grad():
+    for length in lengths:
+      x = torch.randint(1, len(symbols), (1, length), generator=g)
+      x_lengths = torch.LongTensor([length])
+      sid = torch.LongTensor([0]) if net_g.n_speakers > 0 else None
+      torch.manual_seed(seed)
+      o = net_g.infer(x, x_lengths, sid=sid, noise_scale=.667, noise_scale_w=.8)[0]
+      torch.manual_seed(seed)
+      o_frozen = frozen_g.infer(x, x_lengths, sid=sid, noise_scale=.667, noise_scale_w=.8)[0]
+      assert o.shape == o_frozen.shape, "output lengths differ: %s vs %s" % (o.shape, o_frozen.shape)
+      diff = (o - o_frozen).abs().max().item()
+      print("length %d: %d samples, max abs diff %.3e" % (length, o.size(2), diff))
+      max_diff = max(max_diff, diff)
+  assert max_diff <= atol, "frozen model deviates by %.3e > %.1e" % (max_diff, atol)
+  return max_diff
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, required=True, help="JSON file for configuration")
+  parser.add_argument("-m", "--model", type=str, required=True, help="Generator checkpoint (G_*.pth)")
+  parser.add_argument("-o", "--output", type=str, required=True, help="path of the inference checkpoint")
+  parser.add_argument("--check", action="store_true", help="compare waveforms against the unfrozen model")
+  parser.add_argument("--format", choices=["pth", "mmap"], default="pth",
+                      help="torch.save pickle, or a memory-mappable header + tensor blob")
+  args = parser.parse_args()
+
+  net_g, hps = build_model(args.config, freeze=False)
+  _, _, _, iteration = utils.load_checkpoint(args.model, net_g, None)
+  n_params = sum(p.numel() for p in net_g.parameters())
+  frozen_g = net_g
+  if args.check:
+    # weight-normed modules cannot be deep-copied, so load a second instance
+    frozen_g, _ = load_model(args.config, args.model)
+  frozen_g.freeze_for_inference()
+  print("parameters: %d -> %d" % (n_params, sum(p.numel() for p in frozen_g.parameters())))
+  if args.check:
+    check_parity(net_g, frozen_g)
+
+  if args.format == "mmap":
+    with open(args.config) as f:
+      config = json.load(f)
+    utils.save_mapped_checkpoint(frozen_g.state_dict(), args.output, config=config,
+        iteration=iteration, learning_rate=hps.train.learning_rate)
+    if args.check:
+      mapped_g, _ = load_model(None, args.output)
+      check_parity(frozen_g, mapped_g)
+  else:
+    torch.save({"model": frozen_g.state_dict(),
+                "iteration": iteration,
+                "optimizer": None,
+                "learning_rate": hps.train.learning_rate,
+                "frozen": True}, args.output)
+  print("Saved %s (%.1f MB)" % (args.output, os.path.getsize(args.output) / 2**20))
@@ -0,0 +1,146 @@
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from scipy.io.wavfile import write
+
+import commons
+import utils
+from models import SynthesizerTrn
+from text import text_to_sequence
+from text.cleaners import _abbreviations
+from text.symbols import symbols
+
+
+# Sentence ends and clause breaks used by split_text. A period after one of
+# the abbreviations the cleaners expand (Mr., St., ...) or after a single
+# letter (initials, p.m.) does not end a sentence.
+_sentence_re = re.compile(''.join('(?<!%s)' % regex.pattern for regex, _ in _abbreviations) +
+    r'(?<!\b[a-z]\.)(?<=[.!?;:])\s+', re.IGNORECASE)
+_clause_re = re.compile(r'(?<=[,\u2014\u2013])\s+')
+
+
+def get_text(text, hps):
+  text_norm = text_to_sequence(text, hps.data.text_cleaners)
+  if hps.data.add_blank:
+    text_norm = commons.intersperse(text_norm, 0)
+  text_norm = torch.LongTensor(text_norm)
+  return text_norm
+
+
+def load_model(config_path, checkpoint_path, device="cpu"):
+  """config_path may be None for mapped checkpoints from freeze.py --format mmap, which embed their config."""
+  if config_path is None:
+    config = utils.load_mapped_checkpoint(checkpoint_path)["config"]
+    assert config is not None, "%s has no embedded config" % checkpoint_path
+    hps = utils.HParams(**config)
+  else:
+    hps = utils.get_hparams_from_file(config_path)
+  net_g = SynthesizerTrn(
+      len(symbols),
+      hps.data.filter_length // 2 + 1,
+      hps.train.segment_size // hps.data.hop_length,
+      n_speakers=hps.data.n_speakers,
+      **hps.model).to(device)
+  _ = net_g.eval()
+  _ = utils.load_checkpoint(checkpoint_path, net_g, None)
+  return net_g, hps
+
+
+def to_wav_bytes(audio, sampling_rate):
+  """Encodes a float waveform in [-1, 1] as 16-bit PCM WAV bytes."""
+  audio = audio.detach().squeeze().float().clamp(-1, 1).cpu().numpy()
+  buf = io.BytesIO()
+  write(buf, sampling_rate, (audio * 32767).astype(np.int16))
+  return buf.getvalue()
+
+
+def split_text(text, max_chars=150):
+  """Splits a paragraph into sentences, breaking those longer than max_chars at
+  clause punctuation and, failing that, at word boundaries.
+
+  >>> split_text('Mr. Smith met Dr. Jones at 3 p.m. on St. James St. yesterday. He left.')
+  ['Mr. Smith met Dr. Jones at 3 p.m. on St. James St. yesterday.', 'He left.']
+  """
+  segments = []
+  for sentence in _sentence_re.split(text.strip()):
+    pieces = []
+    for clause in _clause_re.split(sentence):
+      if len(clause) > max_chars:
+        pieces.extend(clause.split())
+      else:
+        pieces.append(clause)
+    current = ""
+    for piece in pieces:
+      if current and len(current) + 1 + len(piece) > max_chars:
+        segments.append(current)
+        current = piece
+      else:
+        current = (current + " " + piece).strip()
+    if current:
+      segments.append(current)
+  return segments
+
+
+def join_audio(audios, sampling_rate, silence=0.2, crossfade=0.):
+  """Concatenates 1-D waveforms, either separated by `silence` seconds of zeros
+  or overlapped with a linear crossfade of `crossfade` seconds."""
+  if not audios:
+    return torch.zeros(0)
+  n_fade = int(crossfade * sampling_rate)
+  gap = audios[0].new_zeros(int(silence * sampling_rate))
+  out = audios[0]
+  for audio in audios[1:]:
+    n = min(n_fade, out.size(0), audio.size(0))
+    if n > 0:
+      fade = torch.linspace(0, 1, n, dtype=audio.dtype, device=audio.device)
+      overlap = out[-n:] * (1 - fade) + audio[:n] * fade
+      out = torch.cat([out[:-n], overlap, audio[n:]])
+    else:
+      out = torch.cat([out, gap, audio])
+  return out
+
+
+def synthesize_long(net_g, hps, text, sid=None, noise_scale=.667, length_scale=1, noise_scale_w=.8,
+    max_workers=4, threads_per_worker=None, max_chars=150, silence=0.2, crossfade=0., chunk_size=None):
+  """Synthesizes a paragraph of arbitrary length.
+
+  The text is split with split_text so each segment stays close to the
+  training text lengths, the segments are synthesized concurrently by up to
+  `max_workers` threads and stitched with join_audio. Returns a 1-D waveform.
+
+  `threads_per_worker` sets torch's intra-op thread count for the duration of
+  the call; max_workers * threads_per_worker should not exceed the cores.
+  With `chunk_size`, each segment runs through net_g.infer_chunked so a
+  worker's memory is bounded by that many latent frames.
+  """
+  segments = split_text(text, max_chars)
+  if not segments:
+    # empty or whitespace-only text
+    return torch.zeros(0)
+  # text cleaning stays on this thread; espeak backends are not shared across threads
+  stn_tsts = [get_text(segment, hps) for segment in segments]
+  device = next(net_g.parameters()).device
+
+  def synthesize(stn_tst):
+    with torch.no_grad():
+      x_tst = stn_tst.to(device).unsqueeze(0)
+      x_tst_lengths = torch.LongTensor([stn_tst.size(0)]).to(device)
+      sid_tst = None if sid is None else torch.LongTensor([sid]).to(device)
+      if chunk_size is not None:
+        return net_g.infer_chunked(x_tst, x_tst_lengths, sid=sid_tst, noise_scale=noise_scale, length_scale=length_scale,
+            noise_scale_w=noise_scale_w, chunk_size=chunk_size)[0][0, 0].float().cpu()
+      return net_g.infer(x_tst, x_tst_lengths, sid=sid_tst, noise_scale=noise_scale,
+          length_scale=length_scale, noise_scale_w=noise_scale_w)[0][0, 0].float().cpu()
+
+  num_threads = torch.get_num_threads()
+  if threads_per_worker is not None:
+    torch.set_num_threads(threads_per_worker)
+  try:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+      audios = list(executor.map(synthesize, stn_tsts))
+  finally:
+    torch.set_num_threads(num_threads)
+  return join_audio(audios, hps.data.sampling_rate, silence=silence, crossfade=crossfade)
@@ -0,0 +1,174 @@
+"""WAV header manifest for the filelist loaders.
+
+scan() reads the RIFF header of every wav in a filelist (in parallel; no
+samples are decoded) and records its exact sample count, sampling rate,
+channels, bits per sample and a CRC32 of the first block of the file. The
+result is cached next to the filelist as <filelist>.manifest.json.
+TextAudioLoader and TextAudioSpeakerLoader read it when present: bucket
+lengths become exact (samples // hop_length, the frame count of
+spectrogram_torch with center=False) instead of a stat() per file, and
+files the loaders could not use fail at startup rather than mid-epoch.
+With data.verify_manifest, the loaders also re-read each header and compare
+its sample count and CRC32, catching files changed since the scan.
+
+python manifest.py -c configs/ljs_base.json --workers 32
+"""
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import load_filepaths_and_text, save_atomic
+
+
+MANIFEST_VERSION = 1
+MANIFEST_FIELDS = ["samples", "sampling_rate", "channels", "bits", "crc32"]
+HEAD_BYTES = 65536
+
+
+def manifest_path(filelist):
+  return filelist + ".manifest.json"
+
+
+def read_wav_info(path):
+  """[samples, sampling_rate, channels, bits, crc32 of the first HEAD_BYTES] from the RIFF header."""
+  with open(path, "rb") as f:
+    head = f.read(HEAD_BYTES)
+    if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+      raise ValueError("{} is not a RIFF/WAVE file".format(path))
+    fmt = None
+    pos = 12
+    while True:
+      if pos + 8 > len(head):
+        # chunk headers past the first block (large LIST chunks): read them from disk
+        f.seek(pos)
+        header = f.read(8)
+      else:
+        header = head[pos:pos + 8]
+      if len(header) < 8:
+        raise ValueError("{} has no data chunk".format(path))
+      chunk_id, size = struct.unpack("<4sI", header)
+      if chunk_id == b"fmt ":
+        f.seek(pos + 8)
+        fmt = struct.unpack("<HHIIHH", f.read(16))
+      elif chunk_id == b"data":
+        if fmt is None:
+          raise ValueError("{} has a data chunk before its fmt chunk".format(path))
+        _, channels, sampling_rate, _, block_align, bits = fmt
+        # a truncated file declares more data than it holds
+        size = min(size, os.fstat(f.fileno()).st_size - pos - 8)
+        return [size // block_align, sampling_rate, channels, bits, zlib.crc32(head)]
+      pos += 8 + size + (size & 1)
+
+
+def _scan_one(path):
+  try:
+    return path, read_wav_info(path), None
+  except Exception as e:
+    return path, None, repr(e)
+
+
+def scan(audiopaths, workers=16):
+  """Returns ({path: [samples, sampling_rate, channels, bits, crc32]}, {path: error})."""
+  files = {}
+  errors = {}
+  # header reads are I/O bound, threads overlap them without pickling anything
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for path, info, error in executor.map(_scan_one, sorted(set(audiopaths))):
+      if error is None:
+        files[path] = info
+      else:
+        errors[path] = error
+  return files, errors
+
+
+def save_manifest(path, files, errors):
+  save_atomic(path, lambda f: json.dump(
+      {"version": MANIFEST_VERSION, "fields": MANIFEST_FIELDS, "files": files, "errors": errors}, f), mode="w")
+
+
+def load_manifest(filelist):
+  """The cached manifest of `filelist` as {path: [samples, ...]} and {path: error}, or None."""
+  path = manifest_path(filelist)
+  if not os.path.exists(path):
+    return None
+  with open(path, encoding="utf-8") as f:
+    manifest = json.load(f)
+  if manifest.get("version") != MANIFEST_VERSION:
+    return None
+  return manifest["files"], manifest["errors"]
+
+
+def check_files(audiopaths, manifest, hparams, verify=False, workers=16):
+  """Sample counts of `audiopaths`; raises ValueError naming every file the loaders would fail on.
+
+  With `verify`, every header is read again and its sample count and CRC32
+  compared with the manifest, so files rewritten or truncated since the scan
+  are caught too; without it, no file is touched.
+  """
+  files, errors = manifest
+  samples = []
+  problems = []
+  if verify:
+    current, current_errors = scan(audiopaths, workers)
+    for path in sorted(set(audiopaths)):
+      if path in files and current.get(path) != files[path]:
+        problems.append("{}: {}".format(path, current_errors.get(path, "changed since the manifest was written")))
+  for path in audiopaths:
+    info = files.get(path)
+    if info is None:
+      problems.append("{}: {}".format(path, errors.get(path, "not in the manifest, rerun manifest.py")))
+      continue
+    n, sampling_rate, channels, bits, _ = info
+    if sampling_rate != hparams.sampling_rate:
+      problems.append("{}: {} SR doesn't match target {} SR".format(path, sampling_rate, hparams.sampling_rate))
+    elif channels != 1:
+      problems.append("{}: {} channels, expected mono".format(path, channels))
+    elif bits != 16:
+      problems.append("{}: {}-bit, expected 16-bit PCM".format(path, bits))
+    elif n < hparams.filter_length:
+      problems.append("{}: {} samples is shorter than one STFT frame".format(path, n))
+    samples.append(n)
+  if problems:
+    raise ValueError("{} unusable files:\n  {}{}".format(len(problems), "\n  ".join(problems[:20]),
+        "\n  ..." if len(problems) > 20 else ""))
+  return samples
+
+
+if __name__ == "__main__":
+  import utils
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, required=True, help="JSON file for configuration")
+  parser.add_argument("--filelists", nargs="+", default=None,
+                      help="defaults to data.training_files and data.validation_files")
+  parser.add_argument("--workers", type=int, default=32)
+  parser.add_argument("--verify", action="store_true",
+                      help="compare against the cached manifest instead of rewriting it")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  failed = False
+  for filelist in args.filelists or [hps.data.training_files, hps.data.validation_files]:
+    start = time.time()
+    files, errors = scan([line[0] for line in load_filepaths_and_text(filelist)], args.workers)
+    print("%s: %d files, %.1f hours in %.1fs, %d unreadable" % (filelist, len(files),
+        sum(info[0] / info[1] for info in files.values()) / 3600, time.time() - start, len(errors)))
+    if args.verify:
+      cached = load_manifest(filelist)
+      changed = sorted(p for p in files if cached is None or cached[0].get(p) != files[p])
+      for path in changed:
+        print("  changed %s" % path)
+      failed |= bool(changed)
+    else:
+      save_manifest(manifest_path(filelist), files, errors)
+    try:
+      check_files([line[0] for line in load_filepaths_and_text(filelist)], (files, errors), hps.data)
+    except ValueError as e:
+      print(e)
+      failed = True
+  if failed:
+    raise SystemExit(1)
@@ -0,0 +1,212 @@
+"""Peak activation memory of SynthesizerTrn across input lengths.
+
+Runs the training forward (optionally with backward) or infer() over a sweep
+of text lengths and records allocator peaks per stage: the top-level
+submodules, "other" for code between them (the [b, t_y, t_x] neg_cent and
+attn_mask of monotonic alignment, generate_path, prior expansion) and
+"backward". Allocations are tracked per tensor storage through a dispatch
+mode, so it works on CPU; parameters are not counted, nor is scratch memory
+a kernel frees before returning. A quadratic fit of the peaks against text
+length suggests max_text_len and bucket boundaries for a memory budget.
+
+python memory_profile.py -c configs/ljs_base.json --lengths 50 100 200 400 --backward --budget_mb 10000
+"""
+import argparse
+import contextlib
+import json
+import weakref
+
+import numpy as np
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+from benchmark import build_model
+from losses import kl_loss
+from text.symbols import symbols
+
+
+class MemoryTracker(TorchDispatchMode):
+  """Tracks live bytes of tensor storages allocated while active, with peaks per stage."""
+  def __init__(self):
+    super().__init__()
+    self.live = 0
+    self.peak = 0
+    self.stages = {}
+    self._active = []
+    self._storages = set()
+    self._handles = []
+
+  def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+    out = func(*args, **(kwargs or {}))
+    for t in tree_flatten(out)[0]:
+      if isinstance(t, torch.Tensor):
+        storage = t.untyped_storage()
+        key = id(storage)
+        if key not in self._storages:
+          self._storages.add(key)
+          nbytes = storage.nbytes()
+          self.live += nbytes
+          weakref.finalize(storage, self._release, key, nbytes)
+    self.peak = max(self.peak, self.live)
+    for name in self._active or ["other"]:
+      stage = self.stages.setdefault(name, {"entry": self.live, "peak": 0})
+      stage["peak"] = max(stage["peak"], self.live)
+    return out
+
+  def _release(self, key, nbytes):
+    self._storages.discard(key)
+    self.live -= nbytes
+
+  def enter_stage(self, name):
+    stage = self.stages.setdefault(name, {"entry": self.live, "peak": self.live})
+    stage["entry"] = min(stage["entry"], self.live)
+    self._active.append(name)
+
+  def exit_stage(self, name):
+    self._active.remove(name)
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    self.enter_stage(name)
+    try:
+      yield
+    finally:
+      self.exit_stage(name)
+
+  def watch(self, model, names):
+    """Counts the forward of model.<name> (dotted paths allowed) as its own stage."""
+    for name in names:
+      module = model.get_submodule(name)
+      self._handles.append(module.register_forward_pre_hook(
+          lambda m, inputs, name=name: self.enter_stage(name)))
+      self._handles.append(module.register_forward_hook(
+          lambda m, inputs, outputs, name=name: self.exit_stage(name)))
+
+  def unwatch(self):
+    for handle in self._handles:
+      handle.remove()
+    self._handles = []
+
+  def report(self):
+    """Per stage: absolute peak and increase over the live bytes at stage entry."""
+    return {name: {"peak": s["peak"], "delta": s["peak"] - s["entry"]} for name, s in self.stages.items()}
+
+
+def make_inputs(net_g, hps, length, batch_size, frames_per_token, seed=1234):
+  g = torch.Generator().manual_seed(seed)
+  frames = max(int(round(length * frames_per_token)), hps.train.segment_size // hps.data.hop_length)
+  x = torch.randint(1, len(symbols), (batch_size, length), generator=g)
+  spec = torch.rand(batch_size, hps.data.filter_length // 2 + 1, frames, generator=g)
+  sid = torch.zeros(batch_size, dtype=torch.long) if net_g.n_speakers > 0 else None
+  return x, torch.LongTensor([length] * batch_size), spec, torch.LongTensor([frames] * batch_size), sid
+
+
+def profile_length(net_g, hps, length, batch_size=1, mode="train", backward=False,
+                   frames_per_token=6., stages=None, device="cpu"):
+  x, x_lengths, spec, spec_lengths, sid = [None if t is None else t.to(device) for t in
+      make_inputs(net_g, hps, length, batch_size, frames_per_token)]
+  stages = stages or (["enc_p", "enc_q", "flow", "dp", "dec"] if mode == "train" else ["enc_p", "dp", "flow", "dec"])
+  tracker = MemoryTracker()
+  tracker.watch(net_g, stages)
+  if device.startswith("cuda"):
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats(device)
+    cuda_base = torch.cuda.memory_allocated(device)
+  try:
+    with tracker:
+      if mode == "train":
+        net_g.train()
+        o, l_length, attn, ids_slice, x_mask, z_mask, (z, z_p, m_p, logs_p, m_q, logs_q) = \
+            net_g(x, x_lengths, spec, spec_lengths, sid=sid)
+        frames = spec.size(2)
+        if backward:
+          with tracker.stage("backward"):
+            loss = o.pow(2).mean() + torch.sum(l_length.float()) + kl_loss(z_p, logs_q, m_p, logs_p, z_mask)
+            loss.backward()
+            net_g.zero_grad(set_to_none=True)
+        del o, l_length, attn, z, z_p, m_p, logs_p, m_q, logs_q
+      else:
+        net_g.eval()
+        with torch.no_grad():
+          _, _, y_mask, _ = net_g.infer(x, x_lengths, sid=sid, noise_scale=.667, noise_scale_w=.8)
+        frames = y_mask.size(2)
+  finally:
+    tracker.unwatch()
+  result = {"length": length, "frames": frames, "batch_size": batch_size,
+            "peak": tracker.peak, "stages": tracker.report()}
+  if device.startswith("cuda"):
+    result["cuda_max_allocated"] = torch.cuda.max_memory_allocated(device) - cuda_base
+  return result
+
+
+def fit_scaling(lengths, peaks, degree=2):
+  """Least-squares polynomial (highest power first) of peak bytes against text length."""
+  return np.polyfit(np.asarray(lengths, dtype=np.float64), np.asarray(peaks, dtype=np.float64),
+                    min(degree, len(lengths) - 1)).tolist()
+
+
+def max_length_within(coeffs, budget, limit=100000):
+  """Largest text length whose fitted peak stays within `budget` bytes."""
+  fitted = np.polyval(coeffs, np.arange(1, limit + 1))
+  within = np.nonzero(fitted <= budget)[0]
+  if len(within) == 0:
+    return 0
+  # the fit may dip for tiny lengths; take the end of the first run that fits
+  breaks = np.nonzero(np.diff(within) != 1)[0]
+  return int(within[breaks[0]] if len(breaks) else within[-1]) + 1
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, default="configs/ljs_base.json")
+  parser.add_argument("--mode", choices=["train", "infer"], default="train")
+  parser.add_argument("--backward", action="store_true", help="include backward in train mode")
+  parser.add_argument("--lengths", nargs="+", type=int, default=[50, 100, 200, 400], help="phoneme ids per utterance")
+  parser.add_argument("--batch_size", type=int, default=1)
+  parser.add_argument("--frames_per_token", type=float, default=6.,
+                      help="spectrogram frames per text id in train mode")
+  parser.add_argument("--stages", nargs="+", default=None,
+                      help="submodule paths tracked as stages, e.g. enc_p.encoder dec")
+  parser.add_argument("--device", type=str, default="cpu")
+  parser.add_argument("--budget_mb", type=float, default=None, help="memory budget for the suggested limits")
+  parser.add_argument("--output", type=str, default=None, help="write results and fits as JSON")
+  args = parser.parse_args()
+
+  net_g, hps = build_model(args.config, freeze=args.mode == "infer")
+  net_g.to(args.device)
+  results = [profile_length(net_g, hps, length, args.batch_size, args.mode, args.backward,
+                            args.frames_per_token, args.stages, args.device) for length in args.lengths]
+
+  names = list(results[-1]["stages"])
+  mb = 1024 ** 2
+  print("%6s %6s %9s  %s" % ("length", "frames", "peak(MB)", "  ".join("%9s" % n for n in names)))
+  for r in results:
+    print("%6d %6d %9.1f  %s" % (r["length"], r["frames"], r["peak"] / mb,
+        "  ".join("%9.1f" % (r["stages"].get(n, {"peak": 0})["peak"] / mb) for n in names)))
+
+  lengths = [r["length"] for r in results]
+  fits = {"peak": fit_scaling(lengths, [r["peak"] for r in results])}
+  for n in names:
+    fits[n] = fit_scaling(lengths, [r["stages"].get(n, {"delta": 0})["delta"] for r in results])
+  print("fitted bytes = a*L^2 + b*L + c over text length L (stages: increase over entry)")
+  for n, coeffs in fits.items():
+    print("  %-12s %s" % (n, "  ".join("%.4g" % c for c in coeffs)))
+
+  report = {"config": args.config, "mode": args.mode, "backward": args.backward,
+            "frames_per_token": args.frames_per_token, "results": results, "fits": fits}
+  if args.budget_mb is not None:
+    max_text_len = max_length_within(fits["peak"], args.budget_mb * mb)
+    if hps.data.add_blank:
+      # filelist lengths are counted before blanks are interspersed
+      max_text_len = (max_text_len - 1) // 2
+    report["max_text_len"] = max_text_len
+    print("within %.0f MB at batch size %d: max_text_len %d" % (args.budget_mb, args.batch_size, max_text_len))
+    if args.mode == "train":
+      max_frames = max_length_within(fits["peak"], args.budget_mb * mb) * args.frames_per_token
+      report["max_spec_frames"] = int(max_frames)
+      print("  largest bucket boundary ~%d spectrogram frames" % max_frames)
+  if args.output is not None:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+    print("Saved %s" % args.output)
@@ -1,5 +1,7 @@
 import copy
 import math
+import threading
+from collections import OrderedDict
 import torch
 from torch import nn
 from torch.nn import functional as F
@@ -47,12 +49,17 @@ class StochasticDurationPredictor(nn.Module):
     if gin_channels != 0:
       self.cond = nn.Conv1d(gin_channels, filter_channels, 1)  # [gin_channels, filter_channels, 1]
 
-  def forward(self, x, x_mask, w=None, g=None, reverse=False, noise_scale=1.0):
+  def forward(self, x, x_mask, w=None, g=None, reverse=False, noise_scale=1.0, g_cond=None, generators=None):
     # x.shape: [batch_size, in_channels, x_seqlen]
     # x_mask.shape: [batch_size, 1, x_seqlen]
+    # g_cond: optional precomputed self.cond(g)
+    # generators: optional per-item noise generators, see commons.randn_per_item
+    lengths = None if generators is None else x_mask.sum([1, 2]).long().tolist()
     x = torch.detach(x)
     x = self.pre(x)  # [batch_size, filter_channels, x_seqlen]
-    if g is not None:
+    if g_cond is not None:
+      x = x + g_cond
+    elif g is not None:
       g = torch.detach(g)
       x = x + self.cond(g)  # [batch_size, filter_channels, x_seqlen]
     x = self.convs(x, x_mask)  # [batch_size, filter_channels, x_seqlen]
@@ -66,7 +73,7 @@ class StochasticDurationPredictor(nn.Module):
       h_w = self.post_pre(w)  # [batch_size, filter_channels, x_seqlen]
       h_w = self.post_convs(h_w, x_mask)  # [batch_size, filter_channels, x_seqlen]
       h_w = self.post_proj(h_w) * x_mask  # [batch_size, filter_channels, x_seqlen]
-      e_q = torch.randn(w.size(0), 2, w.size(2)).to(device=x.device, dtype=x.dtype) * x_mask  # [batch_size, 2, x_seqlen]
+      e_q = commons.randn_per_item(w, generators, lengths, channels=2) * x_mask  # [batch_size, 2, x_seqlen]
       z_q = e_q  # [batch_size, 2, x_seqlen]
       for flow in self.post_flows:
         z_q, logdet_q = flow(z_q, x_mask, g=(x + h_w))  # [batch_size, 2, x_seqlen], [batch_size]
@@ -89,13 +96,17 @@ class StochasticDurationPredictor(nn.Module):
     else:
       flows = list(reversed(self.flows))
       flows = flows[:-2] + [flows[-1]]  # remove a useless flow
-      z = torch.randn(x.size(0), 2, x.size(2)).to(device=x.device, dtype=x.dtype) * noise_scale  # [batch_size, 2, x_seqlen]
+      z = commons.randn_per_item(x, generators, lengths, channels=2) * noise_scale  # [batch_size, 2, x_seqlen]
       for flow in flows:
         z = flow(z, x_mask, g=x, reverse=reverse)  # [batch_size, 2, x_seqlen]
       z0, z1 = torch.split(z, [1, 1], 1)  # z0.shape: [batch_size, 1, x_seqlen], z1.shape: [batch_size, 1, x_seqlen]
       logw = z0  # [batch_size, 1, x_seqlen]
       return logw  # [batch_size, 1, x_seqlen]
 
+  def remove_posterior(self):
+    """Drops the posterior branch, which is only used by the training loss."""
+    del self.post_pre, self.post_proj, self.post_convs, self.post_flows
+
 
 
 class DurationPredictor(nn.Module):
@@ -118,9 +129,11 @@ class DurationPredictor(nn.Module):
     if gin_channels != 0:
       self.cond = nn.Conv1d(gin_channels, in_channels, 1)
 
-  def forward(self, x, x_mask, g=None):
+  def forward(self, x, x_mask, g=None, g_cond=None):
     x = torch.detach(x)
-    if g is not None:
+    if g_cond is not None:
+      x = x + g_cond
+    elif g is not None:
       g = torch.detach(g)
       x = x + self.cond(g)
     x = self.conv_1(x * x_mask)
@@ -237,18 +250,32 @@ class ResidualCouplingBlock(nn.Module):
       self.flows.append(modules.ResidualCouplingLayer(channels, hidden_channels, kernel_size, dilation_rate, n_layers, gin_channels=gin_channels, mean_only=True))
       self.flows.append(modules.Flip())
 
-  def forward(self, x, x_mask, g=None, reverse=False):
+  def forward(self, x, x_mask, g=None, reverse=False, g_cond=None):
+    # g_cond: optional list aligned with self.flows holding each coupling
+    # layer's precomputed enc.cond_layer(g) (None for Flip)
+    if g_cond is None:
+      g_cond = [None] * len(self.flows)
     if not reverse:
-      for flow in self.flows:
-        x, _ = flow(x, x_mask, g=g, reverse=reverse)  
+      for flow, c in zip(self.flows, g_cond):
+        x, _ = flow(x, x_mask, g=g, reverse=reverse, g_cond=c)  
         # x.shape: [batch_size, channels, seq_length]
     else:
-      for flow in reversed(self.flows):
-        x = flow(x, x_mask, g=g, reverse=reverse)  
+      for flow, c in zip(reversed(self.flows), reversed(g_cond)):
+        x = flow(x, x_mask, g=g, reverse=reverse, g_cond=c)  
         # x.shape: [batch_size, channels, seq_length]
     return x  
     # Output shape: [batch_size, channels, seq_length]
 
+  def receptive_field(self):
+    """Number of frames on each side of a frame that can affect its output."""
+    wn_field = sum(get_padding(self.kernel_size, self.dilation_rate ** i) for i in range(self.n_layers))
+    return self.n_flows * wn_field
+
+  def remove_weight_norm(self):
+    for l in self.flows:
+      if hasattr(l, 'remove_weight_norm'):
+        l.remove_weight_norm()
+
 
 class PosteriorEncoder(nn.Module):
   def __init__(self,
@@ -272,7 +299,7 @@ class PosteriorEncoder(nn.Module):
     self.enc = modules.WN(hidden_channels, kernel_size, dilation_rate, n_layers, gin_channels=gin_channels)
     self.proj = nn.Conv1d(hidden_channels, out_channels * 2, 1)
 
-  def forward(self, x, x_lengths, g=None):
+  def forward(self, x, x_lengths, g=None, generators=None):
     x_mask = torch.unsqueeze(commons.sequence_mask(x_lengths, x.size(2)), 1).to(x.dtype)  
     # x_mask.shape: [batch_size, 1, seq_length]
 
@@ -289,7 +316,7 @@ class PosteriorEncoder(nn.Module):
     # m.shape: [batch_size, out_channels, seq_length], 
     # logs.shape: [batch_size, out_channels, seq_length]
 
-    z = (m + torch.randn_like(m) * torch.exp(logs)) * x_mask  
+    z = (m + commons.randn_per_item(m, generators, x_lengths) * torch.exp(logs)) * x_mask  
     # z.shape: [batch_size, out_channels, seq_length]
 
     return z, m, logs, x_mask  
@@ -305,6 +332,14 @@ class Generator(torch.nn.Module):
         super(Generator, self).__init__()
         self.num_kernels = len(resblock_kernel_sizes)
         self.num_upsamples = len(upsample_rates)
+        self.upsample_rates = upsample_rates
+        self.upsample_kernel_sizes = upsample_kernel_sizes
+        self.upsample_factor = 1
+        for u in upsample_rates:
+            self.upsample_factor *= u
+        self.resblock_type = resblock
+        self.resblock_kernel_sizes = resblock_kernel_sizes
+        self.resblock_dilation_sizes = resblock_dilation_sizes
         self.conv_pre = Conv1d(initial_channel, upsample_initial_channel, 7, 1, padding=3)
         resblock = modules.ResBlock1 if resblock == '1' else modules.ResBlock2
 
@@ -326,27 +361,53 @@ class Generator(torch.nn.Module):
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, upsample_initial_channel, 1)
 
-    def forward(self, x, g=None):
+    def forward(self, x, g=None, x_mask=None, g_cond=None):
+        # x_mask is only needed for padded batches: it keeps the padded tail of
+        # shorter items from leaking into their valid samples through the convs.
+        # g_cond: optional precomputed self.cond(g)
         x = self.conv_pre(x)
-        if g is not None:
+        if g_cond is not None:
+          x = x + g_cond
+        elif g is not None:
           x = x + self.cond(g)
 
         for i in range(self.num_upsamples):
             x = F.leaky_relu(x, modules.LRELU_SLOPE)
+            if x_mask is not None:
+                x = x * x_mask
+                x_mask = torch.repeat_interleave(x_mask, self.upsample_rates[i], 2)
             x = self.ups[i](x)
             xs = None
             for j in range(self.num_kernels):
                 if xs is None:
-                    xs = self.resblocks[i*self.num_kernels+j](x)
+                    xs = self.resblocks[i*self.num_kernels+j](x, x_mask)
                 else:
-                    xs += self.resblocks[i*self.num_kernels+j](x)
+                    xs += self.resblocks[i*self.num_kernels+j](x, x_mask)
             x = xs / self.num_kernels
         x = F.leaky_relu(x)
+        if x_mask is not None:
+            x = x * x_mask
         x = self.conv_post(x)
         x = torch.tanh(x)
 
         return x
 
+    def receptive_field(self):
+        """Number of input frames on each side of a frame that can affect its output samples."""
+        def resblock_context(k, d):
+            if self.resblock_type == '1':
+                return sum(get_padding(k, di) + get_padding(k, 1) for di in d)
+            return sum(get_padding(k, di) for di in d)
+
+        field = get_padding(7)  # conv_pre
+        scale = 1
+        for u, k in zip(self.upsample_rates, self.upsample_kernel_sizes):
+            field += math.ceil(k / u) / scale
+            scale *= u
+            field += max(resblock_context(k, d) for k, d in zip(self.resblock_kernel_sizes, self.resblock_dilation_sizes)) / scale
+        field += get_padding(7) / scale  # conv_post
+        return int(math.ceil(field))
+
     def remove_weight_norm(self):
         print('Removing weight norm...')
         for l in self.ups:
@@ -446,6 +507,142 @@ class MultiPeriodDiscriminator(torch.nn.Module):
 
 
 
+class SpeakerConditioningCache():
+  """Bounded LRU of per-speaker conditioning for SynthesizerTrn inference.
+
+  An entry holds emb_g(sid) and its projections through the duration
+  predictor, flow and decoder cond layers (see speaker_conditioning), computed
+  on first use. Call clear() after the model weights change.
+  """
+  def __init__(self, net_g, maxsize=256):
+    self.net_g = net_g
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, sid):
+    """Returns the conditioning dict for a [b] LongTensor of speaker ids."""
+    entries = []
+    for s in sid.tolist():
+      with self._lock:
+        entry = self._entries.get(s)
+        if entry is None:
+          self.misses += 1
+        else:
+          self.hits += 1
+          self._entries.move_to_end(s)
+      if entry is None:
+        with torch.no_grad():
+          entry = self.net_g.speaker_conditioning(sid.new_tensor([s]))
+        with self._lock:
+          self._entries[s] = entry
+          while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+      entries.append(entry)
+    if len(entries) == 1:
+      return entries[0]
+    return {
+      'g': torch.cat([e['g'] for e in entries]),
+      'dp': torch.cat([e['dp'] for e in entries]),
+      'flow': [None if c[0] is None else torch.cat(c) for c in zip(*[e['flow'] for e in entries])],
+      'dec': torch.cat([e['dec'] for e in entries])}
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def stats(self):
+    with self._lock:
+      total = self.hits + self.misses
+      return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+              'maxsize': self.maxsize, 'hit_rate': self.hits / total if total else 0.}
+
+
+class TextEncodingCache():
+  """Byte-bounded LRU of per-utterance text encoder outputs for inference.
+
+  Entries are keyed on (phoneme ids, sid, version) and hold enc_p's x, m_p
+  and logs_p without padding. With `cache_durations`, the predicted logw is
+  stored too and noise_scale_w becomes part of the key, so repeated takes
+  keep their rhythm and only resample the flow noise. Bump `version` or
+  clear() after the model weights change.
+  """
+  def __init__(self, max_bytes=256 * 2**20, cache_durations=False, version=0):
+    self.max_bytes = max_bytes
+    self.cache_durations = cache_durations
+    self.version = version
+    self.hits = 0
+    self.misses = 0
+    self.nbytes = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def keys(self, x, x_lengths, sid=None, noise_scale_w=1.):
+    lengths = x_lengths.tolist()
+    sids = [None] * len(lengths) if sid is None else sid.tolist()
+    if torch.is_tensor(noise_scale_w):
+      ws = noise_scale_w.reshape(-1).expand(len(lengths)).tolist()
+    else:
+      ws = [noise_scale_w] * len(lengths)
+    return [(tuple(x[i, :lengths[i]].tolist()), sids[i], ws[i] if self.cache_durations else None, self.version)
+        for i in range(len(lengths))]
+
+  def lookup(self, keys, x_lengths, max_len):
+    """Returns padded (x, m_p, logs_p, x_mask, logw) if every key is cached, else None."""
+    with self._lock:
+      entries = [self._entries.get(k) for k in keys]
+      if any(e is None for e in entries):
+        self.misses += len(keys)
+        return None
+      self.hits += len(keys)
+      for k in keys:
+        self._entries.move_to_end(k)
+
+    def stack(name):
+      return torch.cat([F.pad(e[name], (0, max_len - e[name].size(2))) for e in entries])
+    x, m_p, logs_p = stack('x'), stack('m_p'), stack('logs_p')
+    x_mask = torch.unsqueeze(commons.sequence_mask(x_lengths, max_len), 1).to(x.dtype)
+    logw = stack('logw') if self.cache_durations else None
+    return x, m_p, logs_p, x_mask, logw
+
+  def store(self, keys, x_lengths, x, m_p, logs_p, logw=None):
+    for i, (k, length) in enumerate(zip(keys, x_lengths.tolist())):
+      entry = {'x': x[i:i+1, :, :length].clone(),
+               'm_p': m_p[i:i+1, :, :length].clone(),
+               'logs_p': logs_p[i:i+1, :, :length].clone()}
+      if self.cache_durations:
+        entry['logw'] = logw[i:i+1, :, :length].clone()
+      nbytes = sum(v.numel() * v.element_size() for v in entry.values())
+      if nbytes > self.max_bytes:
+        continue
+      with self._lock:
+        if k in self._entries:
+          self.nbytes -= self._entries.pop(k)['nbytes']
+        entry['nbytes'] = nbytes
+        self._entries[k] = entry
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+          self.nbytes -= self._entries.popitem(last=False)[1]['nbytes']
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.nbytes = 0
+      self.hits = 0
+      self.misses = 0
+
+  def stats(self):
+    with self._lock:
+      total = self.hits + self.misses
+      return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+              'nbytes': self.nbytes, 'max_bytes': self.max_bytes,
+              'hit_rate': self.hits / total if total else 0.}
+
+
 class SynthesizerTrn(nn.Module):
   """
   Synthesizer for Training
@@ -520,6 +717,8 @@ class SynthesizerTrn(nn.Module):
     if n_speakers > 1:
       # 说话人嵌入
       self.emb_g = nn.Embedding(n_speakers, gin_channels)
+    self.speaker_cache = None
+    self.text_cache = None
 
   def forward(self, x, x_lengths, y, y_lengths, sid=None):
     # 文本 -> 先验编码器 -> 条件先验分布
@@ -612,20 +811,86 @@ class SynthesizerTrn(nn.Module):
     return o, l_length, attn, ids_slice, x_mask, y_mask, (z, z_p, m_p, logs_p, m_q, logs_q)
   
 
-  def infer(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., max_len=None):
-    x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
-    if self.n_speakers > 0:
-      g = self.emb_g(sid).unsqueeze(-1) # [b, h, 1]
-    else:
-      g = None
+  def infer(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., max_len=None, generators=None):
+    """generators: optional list with one torch.Generator (on the model's device)
+    or None per item; see commons.make_generators. Seeded items get the same
+    noise whether they are synthesized alone or in a batch."""
+    z, y_mask, cond, (attn, z_p, m_p, logs_p) = self.infer_latent(x, x_lengths, sid=sid,
+        noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w, generators=generators)
+    # a single item has no padding, so the decoder mask is only paid for batches
+    dec_mask = y_mask[:,:,:max_len] if x.size(0) > 1 else None
+    o = self.dec((z * y_mask)[:,:,:max_len], g=cond.get('g'), x_mask=dec_mask, g_cond=cond.get('dec'))
+    return o, attn, y_mask, (z, z_p, m_p, logs_p)
 
-    if self.use_sdp:
-      logw = self.dp(x, x_mask, g=g, reverse=True, noise_scale=noise_scale_w)
+  def speaker_conditioning(self, sid):
+    """Projects emb_g(sid) through every cond layer used by infer().
+
+    Returns a dict with the speaker embedding 'g' and the projections for
+    'dp', 'flow' (one per entry of flow.flows, None for Flip) and 'dec'.
+    """
+    g = self.emb_g(sid).unsqueeze(-1) # [b, h, 1]
+    return {
+      'g': g,
+      'dp': self.dp.cond(g),
+      'flow': [l.enc.cond_layer(g) if isinstance(l, modules.ResidualCouplingLayer) else None for l in self.flow.flows],
+      'dec': self.dec.cond(g)}
+
+  def enable_speaker_cache(self, maxsize=256):
+    """Reuses speaker_conditioning() across infer() calls with an LRU of `maxsize` speakers."""
+    assert self.n_speakers > 0, "n_speakers have to be larger than 0."
+    self.speaker_cache = SpeakerConditioningCache(self, maxsize)
+    return self.speaker_cache
+
+  def enable_text_cache(self, max_bytes=256 * 2**20, cache_durations=False, version=0):
+    """Reuses text encoder outputs (and optionally durations) across infer() calls on the same ids."""
+    self.text_cache = TextEncodingCache(max_bytes, cache_durations, version)
+    return self.text_cache
+
+  def _conditioning(self, sid):
+    if self.n_speakers == 0:
+      return {}
+    if self.speaker_cache is not None and not self.training:
+      return self.speaker_cache.get(sid)
+    return {'g': self.emb_g(sid).unsqueeze(-1)} # [b, h, 1]
+
+  def _infer_durations(self, x, x_lengths, sid=None, length_scale=1, noise_scale_w=1., generators=None):
+    """Text encoder and durations: returns m_p, logs_p at text rate, x_mask,
+    the integer durations w_ceil [b, 1, t_x], y_lengths and the speaker conditioning."""
+    cond = self._conditioning(sid)
+    g = cond.get('g')
+
+    cache = self.text_cache if not self.training else None
+    cached = None
+    if cache is not None:
+      keys = cache.keys(x, x_lengths, sid, noise_scale_w)
+      cached = cache.lookup(keys, x_lengths, x.size(1))
+    if cached is not None:
+      x, m_p, logs_p, x_mask, logw = cached
     else:
-      logw = self.dp(x, x_mask, g=g)
+      x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
+      logw = None
+
+    if logw is None:
+      if self.use_sdp:
+        logw = self.dp(x, x_mask, g=g, reverse=True, noise_scale=noise_scale_w, g_cond=cond.get('dp'), generators=generators)
+      else:
+        logw = self.dp(x, x_mask, g=g, g_cond=cond.get('dp'))
+    if cache is not None and cached is None:
+      cache.store(keys, x_lengths, x, m_p, logs_p, logw)
     w = torch.exp(logw) * x_mask * length_scale
     w_ceil = torch.ceil(w)
     y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
+    return m_p, logs_p, x_mask, w_ceil, y_lengths, cond
+
+  def infer_latent(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., generators=None):
+    """Runs infer() up to the decoder input: text encoder, durations and reverse flow.
+
+    Returns the speaker conditioning dict alongside z so callers can run the
+    decoder with g=cond.get('g'), g_cond=cond.get('dec').
+    """
+    m_p, logs_p, x_mask, w_ceil, y_lengths, cond = self._infer_durations(x, x_lengths, sid=sid,
+        length_scale=length_scale, noise_scale_w=noise_scale_w, generators=generators)
+    g = cond.get('g')
     y_mask = torch.unsqueeze(commons.sequence_mask(y_lengths, None), 1).to(x_mask.dtype)
     attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
     attn = commons.generate_path(w_ceil, attn_mask)
@@ -633,10 +898,147 @@ class SynthesizerTrn(nn.Module):
     m_p = torch.matmul(attn.squeeze(1), m_p.transpose(1, 2)).transpose(1, 2) # [b, t', t], [b, t, d] -> [b, d, t']
     logs_p = torch.matmul(attn.squeeze(1), logs_p.transpose(1, 2)).transpose(1, 2) # [b, t', t], [b, t, d] -> [b, d, t']
 
-    z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
-    z = self.flow(z_p, y_mask, g=g, reverse=True)
-    o = self.dec((z * y_mask)[:,:,:max_len], g=g)
-    return o, attn, y_mask, (z, z_p, m_p, logs_p)
+    z_p = m_p + commons.randn_per_item(m_p, generators, y_lengths) * torch.exp(logs_p) * noise_scale
+    z = self.flow(z_p, y_mask, g=g, reverse=True, g_cond=cond.get('flow'))
+    return z, y_mask, cond, (attn, z_p, m_p, logs_p)
+
+  def infer_stream(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., chunk_size=32, generators=None):
+    """Yields the waveform of a single utterance as [1, 1, t] chunks of `chunk_size` latent frames.
+
+    Each chunk is vocoded from a window padded with the decoder's receptive
+    field, so the concatenated chunks match infer() sample for sample.
+    """
+    assert x.size(0) == 1, "streaming synthesizes one utterance at a time."
+    z, y_mask, cond, _ = self.infer_latent(x, x_lengths, sid=sid,
+        noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w, generators=generators)
+    yield from self._decode_chunks(z * y_mask, cond, chunk_size)
+
+  def _decode_chunks(self, z, cond, chunk_size):
+    # z: [1, c, t_y] with no padding
+    hop_length = self.dec.upsample_factor
+    context = self.dec.receptive_field()
+    t_y = z.size(2)
+    for start in range(0, t_y, chunk_size):
+      end = min(start + chunk_size, t_y)
+      win_start = max(start - context, 0)
+      win_end = min(end + context, t_y)
+      o = self.dec(z[:, :, win_start:win_end], g=cond.get('g'), g_cond=cond.get('dec'))
+      yield o[:, :, (start - win_start) * hop_length:(end - win_start) * hop_length]
+
+  def infer_chunked(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., chunk_size=256, generators=None):
+    """infer() for a single long utterance with memory bounded by `chunk_size` latent frames.
+
+    The prior is expanded per window from the durations instead of through
+    the [t_y, t_x] alignment path, and the reverse flow and the decoder run on
+    windows padded with their receptive fields, so the output matches infer()
+    sample for sample. Only the latents ([1, inter_channels, t_y]) and the
+    waveform are kept whole. Returns o [1, 1, t] and y_mask.
+    """
+    assert x.size(0) == 1, "chunked inference synthesizes one utterance at a time."
+    m_p, logs_p, x_mask, w_ceil, y_lengths, cond = self._infer_durations(x, x_lengths, sid=sid,
+        length_scale=length_scale, noise_scale_w=noise_scale_w, generators=generators)
+    t_y = int(y_lengths[0])
+    y_mask = torch.ones(1, 1, t_y, dtype=x_mask.dtype, device=x_mask.device)
+    # frame f belongs to the text position whose cumulative duration first exceeds f
+    cum_w = torch.cumsum(w_ceil[0, 0], 0)
+    frames = torch.arange(t_y, device=cum_w.device, dtype=cum_w.dtype)
+    ids = torch.searchsorted(cum_w, frames, right=True)
+    valid = (ids < cum_w.size(0)).to(m_p.dtype)
+    ids = ids.clamp(max=cum_w.size(0) - 1)
+    # same layout as the expanded m_p in infer_latent, so randn_like draws the same noise
+    noise = commons.randn_per_item(m_p.new_empty(1, t_y, m_p.size(1)).transpose(1, 2), generators, y_lengths)
+
+    context = self.flow.receptive_field()
+    z = torch.empty(1, m_p.size(1), t_y, dtype=m_p.dtype, device=m_p.device)
+    for start in range(0, t_y, chunk_size):
+      end = min(start + chunk_size, t_y)
+      win_start = max(start - context, 0)
+      win_end = min(end + context, t_y)
+      win_ids, win_valid = ids[win_start:win_end], valid[win_start:win_end]
+      m_w = m_p[:, :, win_ids] * win_valid
+      logs_w = logs_p[:, :, win_ids] * win_valid
+      z_p = m_w + noise[:, :, win_start:win_end] * torch.exp(logs_w) * noise_scale
+      z_w = self.flow(z_p, y_mask[:, :, win_start:win_end], g=cond.get('g'), reverse=True, g_cond=cond.get('flow'))
+      z[:, :, start:end] = z_w[:, :, start - win_start:end - win_start]
+    o = torch.cat(list(self._decode_chunks(z, cond, chunk_size)), 2)
+    return o, y_mask
+
+  def infer_batch(self, texts, sids=None, noise_scale=1, length_scale=1, noise_scale_w=1., max_batch_size=16, seeds=None):
+    """Synthesizes several utterances, returning one trimmed waveform per input.
+
+    texts: list of phoneme-id sequences (lists or 1-D LongTensors).
+    sids, noise_scale, length_scale, noise_scale_w: a scalar shared by all items
+      or a sequence with one value per item.
+    seeds: optional sequence with one seed (or None) per item; a seeded item
+      is reproducible regardless of which batch it lands in.
+
+    Inputs are sorted by length and run in buckets of at most `max_batch_size`
+    items, so each forward pass carries little padding. The returned list of
+    [1, t] waveforms follows the order of `texts`.
+    """
+    n = len(texts)
+    param = next(self.parameters())
+    hop_length = self.dec.upsample_factor
+
+    def per_item(v):
+      if isinstance(v, torch.Tensor):
+        v = v.tolist()
+      if isinstance(v, (list, tuple)):
+        assert len(v) == n, "expected one value per input"
+        return list(v)
+      return [v] * n
+
+    sids = per_item(sids)
+    noise_scales = per_item(noise_scale)
+    length_scales = per_item(length_scale)
+    noise_scales_w = per_item(noise_scale_w)
+    seeds = None if seeds is None else per_item(seeds)
+
+    order = sorted(range(n), key=lambda i: len(texts[i]), reverse=True)
+    outputs = [None] * n
+    for start in range(0, n, max_batch_size):
+      ids = order[start:start + max_batch_size]
+      x_lengths = torch.LongTensor([len(texts[i]) for i in ids])
+      x = torch.zeros(len(ids), int(x_lengths[0]), dtype=torch.long)
+      for j, i in enumerate(ids):
+        x[j, :x_lengths[j]] = torch.as_tensor(texts[i], dtype=torch.long)
+
+      def scales(values):
+        return torch.tensor([values[i] for i in ids], dtype=param.dtype, device=param.device).view(-1, 1, 1)
+
+      sid = None
+      if self.n_speakers > 0:
+        sid = torch.LongTensor([int(sids[i]) for i in ids]).to(param.device)
+      generators = None
+      if seeds is not None:
+        generators = commons.make_generators([seeds[i] for i in ids], param.device)
+      o, _, y_mask, _ = self.infer(x.to(param.device), x_lengths.to(param.device), sid=sid,
+          noise_scale=scales(noise_scales), length_scale=scales(length_scales), noise_scale_w=scales(noise_scales_w),
+          generators=generators)
+      y_lengths = y_mask.sum([1, 2]).long() * hop_length
+      for j, i in enumerate(ids):
+        outputs[i] = o[j, :, :y_lengths[j]]
+    return outputs
+
+  def freeze_for_inference(self):
+    """Strips the model down to what infer() needs.
+
+    Folds weight norm into plain conv weights in the decoder and flow, drops
+    the posterior encoder and the posterior branch of the stochastic duration
+    predictor, and switches to eval mode without gradients. forward() and
+    voice_conversion() are unavailable afterwards.
+    """
+    if getattr(self, 'frozen', False):
+      return self
+    self.dec.remove_weight_norm()
+    self.flow.remove_weight_norm()
+    del self.enc_q
+    if self.use_sdp:
+      self.dp.remove_posterior()
+    self.frozen = True
+    self.eval()
+    self.requires_grad_(False)
+    return self
 
   def voice_conversion(self, y, y_lengths, sid_src, sid_tgt):
     assert self.n_speakers > 0, "n_speakers have to be larger than 0."
@@ -648,3 +1050,30 @@ class SynthesizerTrn(nn.Module):
     o_hat = self.dec(z_hat * y_mask, g=g_tgt)
     return o_hat, y_mask, (z, z_p, z_hat)
 
+  def voice_conversion_many(self, y, y_lengths, sid_src, sid_tgts, max_batch_size=16):
+    """Converts one utterance into several target voices.
+
+    The source spectrogram y [1, spec_channels, t] is encoded and mapped
+    through the forward flow once; only the reverse flow and the decoder run
+    per target, batched over up to `max_batch_size` targets. Returns
+    o_hat [n_targets, 1, t * hop], y_mask and (z, z_p, z_hat).
+    """
+    assert self.n_speakers > 0, "n_speakers have to be larger than 0."
+    assert y.size(0) == 1, "voice_conversion_many converts one source utterance."
+    g_src = self.emb_g(sid_src).unsqueeze(-1)
+    z, m_q, logs_q, y_mask = self.enc_q(y, y_lengths, g=g_src)
+    z_p = self.flow(z, y_mask, g=g_src)
+
+    sid_tgts = torch.as_tensor(sid_tgts, dtype=torch.long, device=y.device).view(-1)
+    o_hats, z_hats = [], []
+    for start in range(0, sid_tgts.size(0), max_batch_size):
+      sid_tgt = sid_tgts[start:start + max_batch_size]
+      n = sid_tgt.size(0)
+      cond = self._conditioning(sid_tgt)
+      z_hat = self.flow(z_p.expand(n, -1, -1), y_mask.expand(n, -1, -1), g=cond['g'], reverse=True,
+          g_cond=cond.get('flow'))
+      # every target shares the source length, so the decoder needs no mask
+      o_hats.append(self.dec(z_hat * y_mask, g=cond['g'], g_cond=cond.get('dec')))
+      z_hats.append(z_hat)
+    return torch.cat(o_hats), y_mask, (z, z_p, torch.cat(z_hats))
+
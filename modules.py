@@ -145,13 +145,15 @@ class WN(torch.nn.Module):
       res_skip_layer = torch.nn.utils.weight_norm(res_skip_layer, name='weight')
       self.res_skip_layers.append(res_skip_layer)
 
-  def forward(self, x, x_mask, g=None, **kwargs):
+  def forward(self, x, x_mask, g=None, g_cond=None, **kwargs):
     output = torch.zeros_like(x)  
     # output.shape: [batch_size, hidden_channels, seq_length]
     n_channels_tensor = torch.IntTensor([self.hidden_channels])  
     # For use in fused_add_tanh_sigmoid_multiply
 
-    if g is not None:
+    if g_cond is not None:
+      g = g_cond  # cond_layer(g) precomputed by the caller
+    elif g is not None:
       g = self.cond_layer(g)  
       # g.shape: [batch_size, 2*hidden_channels*n_layers, seq_length]
 
@@ -338,14 +340,14 @@ class ResidualCouplingLayer(nn.Module):
     self.post.weight.data.zero_()
     self.post.bias.data.zero_()
 
-  def forward(self, x, x_mask, g=None, reverse=False):
+  def forward(self, x, x_mask, g=None, reverse=False, g_cond=None):
     x0, x1 = torch.split(x, [self.half_channels]*2, 1)  
     # x0.shape: [batch_size, half_channels, seq_length], 
     # x1.shape: [batch_size, half_channels, seq_length]
 
     h = self.pre(x0) * x_mask  
     # h.shape: [batch_size, hidden_channels, seq_length]
-    h = self.enc(h, x_mask, g=g)  
+    h = self.enc(h, x_mask, g=g, g_cond=g_cond)  
     # h.shape: [batch_size, hidden_channels, seq_length]
     stats = self.post(h) * x_mask  
     # stats.shape: [batch_size, half_channels * (2 - mean_only), seq_length]
@@ -375,6 +377,9 @@ class ResidualCouplingLayer(nn.Module):
       # x.shape: [batch_size, channels, seq_length]
       return x
 
+  def remove_weight_norm(self):
+    self.enc.remove_weight_norm()
+
 
 class ConvFlow(nn.Module):
   def __init__(self, in_channels, filter_channels, kernel_size, n_layers, num_bins=10, tail_bound=5.0):
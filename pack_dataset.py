@@ -0,0 +1,150 @@
+"""Packs a filelist into a few large memory-mapped shards.
+
+Each shard directory holds raw int16 audio (audio.bin), spectrograms
+(spec.bin, float32 or float16, one flattened [n_freq, frames] block per
+utterance), token ids after cleaning and blank interspersing (text.bin,
+int64) and an int64 index.npy with one row per utterance (columns in
+data_utils.PACKED_INDEX_COLUMNS). meta.json records the STFT settings the
+pack was built with. Pass the output directory as data.training_files or
+data.validation_files and train.py / train_ms.py read it with the packed
+loaders, which return views of the maps instead of opening a wav and a
+spectrogram file per item.
+
+python pack_dataset.py -c configs/ljs_base.json filelists/ljs_audio_text_train_filelist.txt.cleaned /data/packed/ljs_train
+"""
+import argparse
+import collections
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+import commons
+import utils
+from data_utils import PACKED_INDEX_COLUMNS, load_spec
+from text import text_to_sequence, cleaned_text_to_sequence
+from utils import load_filepaths_and_text, load_wav_to_torch
+
+
+def _init_worker():
+  torch.set_num_threads(1)
+
+
+def load_item(line, hparams, spec_dtype="float32"):
+  """Returns (int16 audio, spectrogram, token ids, sid, raw text length) for one filelist line."""
+  audiopath, text = line[0], line[-1]
+  sid = int(line[1]) if len(line) > 2 else -1
+  audio, sampling_rate = load_wav_to_torch(audiopath)
+  if sampling_rate != hparams.sampling_rate:
+    raise ValueError("{} {} SR doesn't match target {} SR".format(audiopath, sampling_rate, hparams.sampling_rate))
+  spec = load_spec(audiopath, (audio / hparams.max_wav_value).unsqueeze(0), hparams,
+      getattr(hparams, "spec_cache_dir", None), getattr(hparams, "spec_cache_dtype", "float32"))
+  if getattr(hparams, "cleaned_text", False):
+    text_norm = cleaned_text_to_sequence(text)
+  else:
+    text_norm = text_to_sequence(text, hparams.text_cleaners)
+  if hparams.add_blank:
+    text_norm = commons.intersperse(text_norm, 0)
+  return (audio.numpy().astype(np.int16), spec.numpy().astype(spec_dtype),
+          np.asarray(text_norm, dtype=np.int64), sid, len(text))
+
+
+class _ShardWriter():
+  def __init__(self, path):
+    os.makedirs(path)
+    self.path = path
+    self.files = {name: open(os.path.join(path, name + ".bin"), "wb") for name in ["audio", "spec", "text"]}
+    self.offsets = {name: 0 for name in self.files}
+    self.rows = []
+    self.bytes = 0
+
+  def add(self, audio, spec, text, sid, text_chars):
+    row = []
+    for name, array in [("audio", audio), ("spec", spec), ("text", text)]:
+      self.files[name].write(np.ascontiguousarray(array).tobytes())
+      row += [self.offsets[name], array.size if name != "spec" else array.shape[1]]
+      self.offsets[name] += array.size
+      self.bytes += array.nbytes
+    self.rows.append(row + [sid, text_chars])
+
+  def close(self):
+    for f in self.files.values():
+      f.close()
+    np.save(os.path.join(self.path, "index.npy"), np.asarray(self.rows, dtype=np.int64).reshape(-1, len(PACKED_INDEX_COLUMNS)))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, required=True, help="JSON file for configuration")
+  parser.add_argument("filelist", type=str)
+  parser.add_argument("output", type=str, help="directory to create")
+  parser.add_argument("--spec_dtype", choices=["float32", "float16"], default="float32",
+                      help="float16 halves the pack; the loaders convert back to float32 per item")
+  parser.add_argument("--shard_size_mb", type=float, default=2048)
+  parser.add_argument("--workers", type=int, default=os.cpu_count())
+  parser.add_argument("--overwrite", action="store_true")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  lines = load_filepaths_and_text(args.filelist)
+  if os.path.exists(args.output):
+    assert args.overwrite, "%s exists, pass --overwrite to replace it" % args.output
+  tmp_output = args.output + ".tmp"
+  shutil.rmtree(tmp_output, ignore_errors=True)
+  os.makedirs(tmp_output)
+
+  start = time.time()
+  shards = []
+  writer = None
+  errors = []
+  n_freq = hps.data.filter_length // 2 + 1
+  window = 4 * args.workers
+  with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as executor:
+    # at most `window` items are loaded ahead of the writer, so parent memory
+    # stays bounded when writing falls behind
+    futures = collections.deque()
+    for i in range(len(lines)):
+      while len(futures) < window and i + len(futures) < len(lines):
+        futures.append(executor.submit(load_item, lines[i + len(futures)], hps.data, args.spec_dtype))
+      future = futures.popleft()
+      try:
+        item = future.result()
+      except Exception as e:
+        errors.append((lines[i][0], repr(e)))
+        print("failed %s: %r" % (lines[i][0], e))
+        continue
+      if writer is None or writer.bytes >= args.shard_size_mb * 1024 ** 2:
+        if writer is not None:
+          writer.close()
+        shards.append("shard_%05d" % len(shards))
+        writer = _ShardWriter(os.path.join(tmp_output, shards[-1]))
+      writer.add(*item)
+      if (i + 1) % 1000 == 0:
+        print("%d/%d files, %.1fs" % (i + 1, len(lines), time.time() - start))
+  if writer is not None:
+    writer.close()
+
+  meta = {
+    "filelist": args.filelist,
+    "sampling_rate": hps.data.sampling_rate,
+    "filter_length": hps.data.filter_length,
+    "hop_length": hps.data.hop_length,
+    "win_length": hps.data.win_length,
+    "max_wav_value": hps.data.max_wav_value,
+    "add_blank": hps.data.add_blank,
+    "n_freq": n_freq,
+    "spec_dtype": args.spec_dtype,
+    "columns": PACKED_INDEX_COLUMNS,
+    "shards": shards}
+  with open(os.path.join(tmp_output, "meta.json"), "w") as f:
+    json.dump(meta, f, indent=2)
+  shutil.rmtree(args.output, ignore_errors=True)
+  os.replace(tmp_output, args.output)
+  print("%d utterances in %d shards at %s in %.1fs, %d failed" % (
+      len(lines) - len(errors), len(shards), args.output, time.time() - start, len(errors)))
+  if errors:
+    raise SystemExit(1)
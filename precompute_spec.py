@@ -0,0 +1,80 @@
+"""Precomputes linear spectrograms for every wav in the filelists.
+
+Spectrograms are written as .npy files (float32 or float16) under
+data.spec_cache_dir, or --cache_dir, at the paths the loaders read
+(data_utils.spec_cache_path). Each file is written to a temporary name and
+renamed, so training can start while the tool runs and read-only dataset
+mounts stay untouched.
+
+python precompute_spec.py -c configs/ljs_base.json --cache_dir /data/cache/ljs --workers 16
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+import utils
+from data_utils import compute_spec, spec_cache_path
+from utils import load_filepaths_and_text, load_wav_to_torch, save_atomic
+
+
+def _init_worker():
+  # one STFT per process; intra-op threads would only oversubscribe the pool
+  torch.set_num_threads(1)
+
+
+def precompute(audiopath, hparams, cache_dir, dtype="float32", overwrite=False):
+  """Returns (audiopath, frames, error)."""
+  spec_filename = spec_cache_path(cache_dir, audiopath, hparams)
+  try:
+    if not overwrite and os.path.exists(spec_filename):
+      return audiopath, np.load(spec_filename, mmap_mode="r").shape[-1], None
+    audio, sampling_rate = load_wav_to_torch(audiopath)
+    if sampling_rate != hparams.sampling_rate:
+      raise ValueError("{} SR doesn't match target {} SR".format(sampling_rate, hparams.sampling_rate))
+    spec = compute_spec((audio / hparams.max_wav_value).unsqueeze(0), hparams)
+    save_atomic(spec_filename, lambda f: np.save(f, spec.numpy().astype(dtype)))
+    return audiopath, spec.size(-1), None
+  except Exception as e:
+    return audiopath, 0, repr(e)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, required=True, help="JSON file for configuration")
+  parser.add_argument("--filelists", nargs="+", default=None,
+                      help="defaults to data.training_files and data.validation_files")
+  parser.add_argument("--cache_dir", type=str, default=None, help="defaults to data.spec_cache_dir")
+  parser.add_argument("--dtype", choices=["float32", "float16"], default=None,
+                      help="defaults to data.spec_cache_dtype or float32")
+  parser.add_argument("--workers", type=int, default=os.cpu_count())
+  parser.add_argument("--overwrite", action="store_true", help="recompute files that already exist")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  cache_dir = args.cache_dir or getattr(hps.data, "spec_cache_dir", None)
+  assert cache_dir is not None, "set data.spec_cache_dir in the config or pass --cache_dir"
+  dtype = args.dtype or getattr(hps.data, "spec_cache_dtype", "float32")
+  filelists = args.filelists or [hps.data.training_files, hps.data.validation_files]
+  audiopaths = sorted({line[0] for f in filelists for line in load_filepaths_and_text(f)})
+
+  start = time.time()
+  frames = 0
+  errors = []
+  with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as executor:
+    futures = [executor.submit(precompute, a, hps.data, cache_dir, dtype, args.overwrite) for a in audiopaths]
+    for i, future in enumerate(futures):
+      audiopath, n, error = future.result()
+      frames += n
+      if error is not None:
+        errors.append((audiopath, error))
+        print("failed %s: %s" % (audiopath, error))
+      if (i + 1) % 1000 == 0:
+        print("%d/%d files, %.1fs" % (i + 1, len(audiopaths), time.time() - start))
+  print("%d files, %d frames in %s (%s) in %.1fs, %d failed" % (
+      len(audiopaths) - len(errors), frames, cache_dir, dtype, time.time() - start, len(errors)))
+  if errors:
+    raise SystemExit(1)
@@ -1,6 +1,32 @@
 import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import text
-from utils import load_filepaths_and_text
+from data_utils import remove_tokenized, save_tokenized
+from utils import load_filepaths_and_text, save_atomic
+
+
+def clean_chunk(texts, text_cleaners):
+  cleaned_texts = text._clean_texts(texts, text_cleaners)
+  # a misaligned chunk would pair phonemes with the wrong audio for the rest
+  # of it, so it must fail here rather than be checkpointed as a part file
+  if len(cleaned_texts) != len(texts):
+    raise ValueError("cleaners returned %d lines for %d texts" % (len(cleaned_texts), len(texts)))
+  for raw, cleaned in zip(texts, cleaned_texts):
+    # a shift shows up as text where an empty transcript should stay empty
+    if "\n" in cleaned or (raw.strip() == "" and cleaned.strip() != ""):
+      raise ValueError("misaligned cleaner output %r for %r" % (cleaned, raw))
+  return cleaned_texts
+
+
+def write_lines_atomic(path, lines):
+  save_atomic(path, lambda f: f.writelines(lines), mode="w")
+
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
@@ -8,18 +34,75 @@ if __name__ == '__main__':
   parser.add_argument("--text_index", default=1, type=int)
   parser.add_argument("--filelists", nargs="+", default=["filelists/ljs_audio_text_val_filelist.txt", "filelists/ljs_audio_text_test_filelist.txt"])
   parser.add_argument("--text_cleaners", nargs="+", default=["english_cleaners2"])
+  parser.add_argument("--num_workers", default=os.cpu_count(), type=int)
+  parser.add_argument("--chunk_size", default=1000, type=int, help="lines cleaned per worker task and per checkpoint")
+  parser.add_argument("--tokenize", action="store_true",
+                      help="also write symbol ids and offsets (.ids.npy, .offsets.npy) for the loaders")
+  parser.add_argument("--add_blank", action="store_true", help="intersperse blanks in the ids, as data.add_blank")
 
   args = parser.parse_args()
-    
+
 
   for filelist in args.filelists:
     print("START:", filelist)
     filepaths_and_text = load_filepaths_and_text(filelist)
-    for i in range(len(filepaths_and_text)):
-      original_text = filepaths_and_text[i][args.text_index]
-      cleaned_text = text._clean_text(original_text, args.text_cleaners)
-      filepaths_and_text[i][args.text_index] = cleaned_text
-
     new_filelist = filelist + "." + args.out_extension
-    with open(new_filelist, "w", encoding="utf-8") as f:
-      f.writelines(["|".join(x) + "\n" for x in filepaths_and_text])
+
+    # Finished chunks are checkpointed under <new_filelist>.parts, so an
+    # interrupted run only re-cleans the chunks that were still missing.
+    # Parts are only reused when they were cleaned from the same filelist with
+    # the same settings; otherwise they are discarded.
+    parts_dir = new_filelist + ".parts"
+    with open(filelist, "rb") as f:
+      parts_manifest = {"filelist_sha1": hashlib.sha1(f.read()).hexdigest(), "text_cleaners": args.text_cleaners,
+                        "text_index": args.text_index, "chunk_size": args.chunk_size}
+    parts_manifest_path = os.path.join(parts_dir, "manifest.json")
+    if os.path.isdir(parts_dir):
+      try:
+        with open(parts_manifest_path, encoding="utf-8") as f:
+          stale = json.load(f) != parts_manifest
+      except (OSError, ValueError):
+        stale = True
+      if stale:
+        print("DISCARD: %s was cleaned from another filelist or settings" % parts_dir)
+        shutil.rmtree(parts_dir)
+    if not os.path.isdir(parts_dir):
+      os.makedirs(parts_dir)
+      write_lines_atomic(parts_manifest_path, [json.dumps(parts_manifest)])
+    chunks = [(start, min(start + args.chunk_size, len(filepaths_and_text)))
+        for start in range(0, len(filepaths_and_text), args.chunk_size)]
+    part_paths = [os.path.join(parts_dir, "%09d_%09d.txt" % chunk) for chunk in chunks]
+    pending = [(chunk, path) for chunk, path in zip(chunks, part_paths) if not os.path.exists(path)]
+    if len(pending) < len(chunks):
+      print("RESUME: %d/%d chunks already cleaned" % (len(chunks) - len(pending), len(chunks)))
+
+    n_pending = sum(end - start for (start, end), _ in pending)
+    start_time = time.time()
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+      futures = {}
+      for (start, end), path in pending:
+        texts = [x[args.text_index] for x in filepaths_and_text[start:end]]
+        futures[executor.submit(clean_chunk, texts, args.text_cleaners)] = (path, (start, end))
+      for future in as_completed(futures):
+        cleaned_texts = future.result()
+        start, end = futures[future][1]
+        assert len(cleaned_texts) == end - start, "chunk %d-%d returned %d lines" % (start, end, len(cleaned_texts))
+        write_lines_atomic(futures[future][0], [x + "\n" for x in cleaned_texts])
+        n_done += len(cleaned_texts)
+        elapsed = time.time() - start_time
+        print("  %d/%d lines, %.1f lines/sec" % (n_done, n_pending, n_done / max(elapsed, 1e-6)))
+
+    for (start, end), path in zip(chunks, part_paths):
+      with open(path, encoding="utf-8") as f:
+        cleaned_texts = [line.rstrip("\n") for line in f]
+      assert len(cleaned_texts) == end - start, "corrupt checkpoint %s" % path
+      for i, cleaned_text in enumerate(cleaned_texts):
+        filepaths_and_text[start + i][args.text_index] = cleaned_text
+
+    write_lines_atomic(new_filelist, ["|".join(x) + "\n" for x in filepaths_and_text])
+    # arrays from an earlier run no longer describe the rewritten filelist
+    remove_tokenized(new_filelist)
+    if args.tokenize:
+      save_tokenized(new_filelist, [x[args.text_index] for x in filepaths_and_text], args.add_blank)
+    shutil.rmtree(parts_dir)
@@ -0,0 +1,176 @@
+"""Opt-in per-module timing for SynthesizerTrn and the discriminators.
+
+Hooks exist only inside the profile_modules() context, so models run
+untouched otherwise. Times are inclusive: a module's time contains its
+children's.
+
+  with profile_modules(net_g, max_depth=3) as prof:
+    net_g.infer(x, x_lengths)
+  print(prof.table())
+
+python profiling.py -c configs/ljs_base.json --length 100 --max_depth 2 --json profile.json
+"""
+import argparse
+import contextlib
+import json
+import math
+import time
+
+import torch
+
+
+def _output_bytes(outputs):
+  if isinstance(outputs, torch.Tensor):
+    return outputs.numel() * outputs.element_size()
+  if isinstance(outputs, (list, tuple)):
+    return sum(_output_bytes(o) for o in outputs)
+  if isinstance(outputs, dict):
+    return sum(_output_bytes(o) for o in outputs.values())
+  return 0
+
+
+def _first_shape(outputs):
+  if isinstance(outputs, torch.Tensor):
+    return list(outputs.shape)
+  if isinstance(outputs, (list, tuple)):
+    for o in outputs:
+      shape = _first_shape(o)
+      if shape is not None:
+        return shape
+  return None
+
+
+class ModuleProfiler():
+  """Collects call counts, wall times and output sizes per module path."""
+  def __init__(self, model, max_depth=None, sync_cuda=True):
+    self.model = model
+    self.max_depth = max_depth
+    self.sync_cuda = sync_cuda and torch.cuda.is_available()
+    self.records = {}
+    self._starts = {}
+    self._handles = []
+
+  def attach(self):
+    for name, module in self.model.named_modules():
+      depth = 0 if name == "" else name.count(".") + 1
+      if self.max_depth is not None and depth > self.max_depth:
+        continue
+      name = name or type(self.model).__name__
+      self._handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+      self._handles.append(module.register_forward_hook(self._hook(name, type(module).__name__)))
+    return self
+
+  def detach(self):
+    for handle in self._handles:
+      handle.remove()
+    self._handles = []
+
+  def _pre_hook(self, name):
+    def hook(module, inputs):
+      if self.sync_cuda:
+        torch.cuda.synchronize()
+      self._starts.setdefault(name, []).append(time.perf_counter())
+    return hook
+
+  def _hook(self, name, type_name):
+    def hook(module, inputs, outputs):
+      if self.sync_cuda:
+        torch.cuda.synchronize()
+      elapsed = time.perf_counter() - self._starts[name].pop()
+      record = self.records.get(name)
+      if record is None:
+        record = self.records[name] = {"type": type_name, "times": [], "output_bytes": 0, "output_shape": None}
+      record["times"].append(elapsed)
+      record["output_bytes"] += _output_bytes(outputs)
+      record["output_shape"] = _first_shape(outputs)
+    return hook
+
+  def reset(self):
+    self.records = {}
+
+  def stats(self):
+    """Per module path: calls, total/mean/p99 seconds, mean output bytes and last output shape."""
+    stats = {}
+    for name, record in self.records.items():
+      times = sorted(record["times"])
+      calls = len(times)
+      total = sum(times)
+      stats[name] = {
+        "type": record["type"],
+        "calls": calls,
+        "total": total,
+        "mean": total / calls,
+        "p99": times[min(calls - 1, int(math.ceil(0.99 * calls)) - 1)],
+        "output_bytes": record["output_bytes"] / calls,
+        "output_shape": record["output_shape"]}
+    return stats
+
+  def table(self, sort_by="total", limit=None):
+    stats = sorted(self.stats().items(), key=lambda kv: -kv[1][sort_by])
+    if limit is not None:
+      stats = stats[:limit]
+    width = max([len(name) for name, _ in stats] + [6])
+    lines = ["%-*s %-28s %6s %10s %10s %10s %10s  %s" % (
+        width, "module", "type", "calls", "total(ms)", "mean(ms)", "p99(ms)", "out(KiB)", "out shape")]
+    for name, s in stats:
+      lines.append("%-*s %-28s %6d %10.3f %10.3f %10.3f %10.1f  %s" % (
+          width, name, s["type"], s["calls"], 1e3 * s["total"], 1e3 * s["mean"], 1e3 * s["p99"],
+          s["output_bytes"] / 1024, s["output_shape"]))
+    return "\n".join(lines)
+
+  def to_json(self, path=None):
+    data = json.dumps(self.stats(), indent=2)
+    if path is not None:
+      with open(path, "w") as f:
+        f.write(data)
+    return data
+
+
+@contextlib.contextmanager
+def profile_modules(model, max_depth=None, sync_cuda=True):
+  """Registers timing hooks on `model` and its submodules for the duration of the block."""
+  profiler = ModuleProfiler(model, max_depth, sync_cuda).attach()
+  try:
+    yield profiler
+  finally:
+    profiler.detach()
+
+
+if __name__ == "__main__":
+  from benchmark import build_model
+  from models import MultiPeriodDiscriminator
+  from text.symbols import symbols
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, default="configs/ljs_base.json")
+  parser.add_argument("--length", type=int, default=100, help="phoneme ids per utterance")
+  parser.add_argument("--batch_size", type=int, default=1)
+  parser.add_argument("--max_depth", type=int, default=3)
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--discriminator", action="store_true",
+                      help="profile MultiPeriodDiscriminator on a training segment instead of infer()")
+  parser.add_argument("--limit", type=int, default=40, help="rows shown in the table")
+  parser.add_argument("--json", type=str, default=None, help="write per-module stats as JSON")
+  args = parser.parse_args()
+
+  net_g, hps = build_model(args.config)
+  if args.discriminator:
+    model = MultiPeriodDiscriminator(hps.model.use_spectral_norm).eval()
+    y = torch.randn(args.batch_size, 1, hps.train.segment_size)
+    run = lambda: model(y, y)
+  else:
+    model = net_g
+    x = torch.randint(1, len(symbols), (args.batch_size, args.length))
+    x_lengths = torch.LongTensor([args.length] * args.batch_size)
+    sid = torch.zeros(args.batch_size, dtype=torch.long) if net_g.n_speakers > 0 else None
+    run = lambda: net_g.infer(x, x_lengths, sid=sid, noise_scale=.667, noise_scale_w=.8)
+
+  with torch.no_grad():
+    run()  # warmup outside the profiler
+    with profile_modules(model, args.max_depth) as prof:
+      for _ in range(args.repeats):
+        run()
+  print(prof.table(limit=args.limit))
+  if args.json is not None:
+    prof.to_json(args.json)
+    print("Saved %s" % args.json)
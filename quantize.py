@@ -0,0 +1,224 @@
+"""Builds an int8 variant of a frozen SynthesizerTrn for CPU inference.
+
+Two modes are available for the selected submodules:
+  dynamic: 1x1 Conv1d projections (attention q/k/v/o, encoder output
+    projections) run as int8 Linear layers with per-call activation scales.
+  static: every Conv1d and ConvTranspose1d runs in int8 with activation
+    scales calibrated on a filelist.
+Wider convs are left out of dynamic mode because torch's dynamic int8 conv
+kernels lose most of the signal once inputs are not centered on zero, so
+dynamic mode defaults to enc_p only: dec has no 1x1 convs outside the
+speaker conditioning of multi-speaker models.
+The tool reports real-time factor, mel L1 and waveform SNR against the fp32
+model and saves the int8 model as TorchScript with export.py's wrapper.
+
+python quantize.py -c configs/ljs_base.json -m /path/to/pretrained_ljs.pth -o ljs_base_int8.pt --mode static
+
+Quantized weights are packed for one engine; load the TorchScript module
+with torch.backends.quantized.engine set to the engine printed here.
+"""
+import argparse
+import time
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+from export import SynthesizerExport, example_inputs, export_torchscript
+from inference import load_model
+from mel_processing import mel_spectrogram_torch
+from text import cleaned_text_to_sequence, text_to_sequence
+import commons
+import utils
+
+try:
+  from torch.ao import quantization as tq
+except ImportError:
+  from torch import quantization as tq
+
+
+def set_engine():
+  # the x86 and onednn kernels return wrong ConvTranspose1d outputs, so stick to fbgemm/qnnpack
+  for engine in ("fbgemm", "qnnpack"):
+    if engine in torch.backends.quantized.supported_engines:
+      torch.backends.quantized.engine = engine
+      return engine
+  raise RuntimeError("no supported quantized engine in %s" % torch.backends.quantized.supported_engines)
+
+
+class Conv1x1(nn.Module):
+  """A pointwise Conv1d computed with nn.Linear over [b, t, c]."""
+  def __init__(self, conv):
+    super().__init__()
+    self.linear = nn.Linear(conv.in_channels, conv.out_channels, bias=conv.bias is not None)
+    self.linear.weight.data.copy_(conv.weight.data[:, :, 0])
+    if conv.bias is not None:
+      self.linear.bias.data.copy_(conv.bias.data)
+
+  def forward(self, x):
+    return self.linear(x.transpose(1, 2)).transpose(1, 2)
+
+
+def _is_pointwise(conv):
+  return (type(conv) == nn.Conv1d and conv.kernel_size == (1,) and conv.stride == (1,)
+      and conv.padding == (0,) and conv.dilation == (1,) and conv.groups == 1)
+
+
+def _replace_pointwise(module):
+  n = 0
+  for name, child in module.named_children():
+    if _is_pointwise(child):
+      setattr(module, name, Conv1x1(child))
+      n += 1
+    else:
+      n += _replace_pointwise(child)
+  return n
+
+
+def quantize_dynamic(net_g, parts=("enc_p",)):
+  """Quantizes the 1x1 convs of net_g.<part> to int8 Linear layers in place and
+  returns how many were converted."""
+  n = 0
+  for part in parts:
+    n_part = _replace_pointwise(getattr(net_g, part))
+    if n_part == 0:
+      utils.logger.warning("%s has no 1x1 convs, dynamic mode leaves it in fp32" % part)
+    n += n_part
+    tq.quantize_dynamic(getattr(net_g, part), {nn.Linear}, dtype=torch.qint8, inplace=True)
+  return n
+
+
+def _wrap_convs(module, qconfig, qconfig_transpose):
+  n = 0
+  for name, child in module.named_children():
+    if type(child) in (nn.Conv1d, nn.ConvTranspose1d):
+      wrapped = tq.QuantWrapper(child)
+      wrapped.qconfig = qconfig_transpose if isinstance(child, nn.ConvTranspose1d) else qconfig
+      setattr(module, name, wrapped)
+      n += 1
+    else:
+      n += _wrap_convs(child, qconfig, qconfig_transpose)
+  return n
+
+
+def quantize_static(net_g, calibrate, parts=("enc_p", "dec")):
+  """Quantizes convs of net_g.<part> with calibrated activation scales in place
+  and returns how many were converted.
+
+  Each conv is wrapped in quantize/dequantize stubs, so everything between
+  them (activations, residual adds, flows) keeps running in fp32.
+  calibrate(net_g) runs inference on representative inputs.
+  """
+  qconfig = tq.get_default_qconfig(torch.backends.quantized.engine)
+  # transposed convs only support per-tensor weight scales
+  qconfig_transpose = tq.QConfig(activation=qconfig.activation, weight=tq.default_weight_observer)
+  n = 0
+  for part in parts:
+    n += _wrap_convs(getattr(net_g, part), qconfig, qconfig_transpose)
+  tq.prepare(net_g, inplace=True)
+  calibrate(net_g)
+  tq.convert(net_g, inplace=True)
+  return n
+
+
+def load_items(filelist, hps, n):
+  """Returns (phoneme ids, speaker id) for the first n lines of a filelist."""
+  items = []
+  for line in utils.load_filepaths_and_text(filelist)[:n]:
+    if hps.data.cleaned_text:
+      text_norm = cleaned_text_to_sequence(line[-1])
+    else:
+      text_norm = text_to_sequence(line[-1], hps.data.text_cleaners)
+    if hps.data.add_blank:
+      text_norm = commons.intersperse(text_norm, 0)
+    sid = int(line[1]) if hps.data.n_speakers > 0 else None
+    items.append((torch.LongTensor(text_norm), sid))
+  return items
+
+
+def _infer(net_g, x, sid, seed):
+  torch.manual_seed(seed)
+  sid = None if sid is None else torch.LongTensor([sid])
+  return net_g.infer(x.unsqueeze(0), torch.LongTensor([x.size(0)]), sid=sid,
+      noise_scale=.667, noise_scale_w=.8)[0][0]
+
+
+def evaluate(net_g, q_g, items, hps, seed=1234):
+  """Compares q_g against net_g with identical noise draws.
+
+  Quantization may shift the predicted durations, in which case the
+  waveforms are compared over their common prefix.
+  """
+  time_ref = time_q = 0.
+  n_samples = 0
+  mel_l1 = snr = 0.
+  with torch.no_grad():
+    for x, sid in items:
+      start = time.perf_counter()
+      y = _infer(net_g, x, sid, seed)
+      time_ref += time.perf_counter() - start
+      start = time.perf_counter()
+      y_q = _infer(q_g, x, sid, seed)
+      time_q += time.perf_counter() - start
+      n_samples += y.size(1)
+
+      n = min(y.size(1), y_q.size(1))
+      y, y_q = y[:, :n], y_q[:, :n]
+      mels = [mel_spectrogram_torch(
+          wav,
+          hps.data.filter_length,
+          hps.data.n_mel_channels,
+          hps.data.sampling_rate,
+          hps.data.hop_length,
+          hps.data.win_length,
+          hps.data.mel_fmin,
+          hps.data.mel_fmax) for wav in (y, y_q)]
+      mel_l1 += F.l1_loss(mels[0], mels[1]).item()
+      snr += 10 * torch.log10(y.pow(2).sum() / (y - y_q).pow(2).sum().clamp(min=1e-12)).item()
+  duration = n_samples / hps.data.sampling_rate
+  return {"rtf_fp32": time_ref / duration, "rtf_int8": time_q / duration,
+          "mel_l1": mel_l1 / len(items), "snr_db": snr / len(items)}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, required=True, help="JSON file for configuration")
+  parser.add_argument("-m", "--model", type=str, required=True, help="Generator checkpoint (G_*.pth)")
+  parser.add_argument("-o", "--output", type=str, default=None, help="path of the int8 TorchScript module")
+  parser.add_argument("--mode", choices=["dynamic", "static"], default="dynamic")
+  parser.add_argument("--parts", nargs="+", default=None, choices=["enc_p", "dp", "flow", "dec"],
+                      help="submodules of SynthesizerTrn to quantize (default: enc_p for dynamic, enc_p dec for static)")
+  parser.add_argument("--calibration_files", type=str, default=None, help="defaults to data.training_files")
+  parser.add_argument("--num_calibration", type=int, default=32)
+  parser.add_argument("--eval_files", type=str, default=None, help="defaults to data.validation_files")
+  parser.add_argument("--num_eval", type=int, default=16)
+  args = parser.parse_args()
+  if args.parts is None:
+    args.parts = ["enc_p"] if args.mode == "dynamic" else ["enc_p", "dec"]
+
+  engine = set_engine()
+  net_g, hps = load_model(args.config, args.model)
+  net_g.freeze_for_inference()
+  q_g, _ = load_model(args.config, args.model)
+  q_g.freeze_for_inference()
+
+  if args.mode == "dynamic":
+    n_quantized = quantize_dynamic(q_g, args.parts)
+  else:
+    calibration_items = load_items(args.calibration_files or hps.data.training_files, hps, args.num_calibration)
+    def calibrate(model):
+      with torch.no_grad():
+        for x, sid in calibration_items:
+          _infer(model, x, sid, 1234)
+    n_quantized = quantize_static(q_g, calibrate, args.parts)
+
+  eval_items = load_items(args.eval_files or hps.data.validation_files, hps, args.num_eval)
+  stats = evaluate(net_g, q_g, eval_items, hps)
+  print("engine %s, mode %s, parts %s: %d layers in int8" % (engine, args.mode, " ".join(args.parts), n_quantized))
+  print("RTF fp32 %.4f, int8 %.4f (%.2fx)" % (stats["rtf_fp32"], stats["rtf_int8"], stats["rtf_fp32"] / stats["rtf_int8"]))
+  print("mel L1 %.4f, SNR %.2f dB" % (stats["mel_l1"], stats["snr_db"]))
+
+  if args.output is not None:
+    model = SynthesizerExport(q_g).eval()
+    export_torchscript(model, example_inputs(q_g, 50), args.output)
+    print("Saved %s" % args.output)
@@ -0,0 +1,182 @@
+"""Local HTTP synthesis server with dynamic micro-batching.
+
+POST /synthesize with a JSON body
+  {"text": "...", "sid": 0, "noise_scale": .667, "noise_scale_w": .8, "length_scale": 1, "seed": 1234}
+returns 16-bit WAV bytes; "seed" is optional and makes the take reproducible. Requests arriving within --max_wait_ms of each other
+are coalesced (up to --max_batch_size) and synthesized by
+SynthesizerTrn.infer_batch in length-sorted buckets of --bucket_size.
+
+python server.py -c configs/ljs_base.json -m /path/to/pretrained_ljs.pth
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import utils
+from inference import get_text, load_model, to_wav_bytes
+
+
+class MicroBatcher():
+  """Coalesces queued synthesis requests into batches for SynthesizerTrn.infer_batch."""
+  def __init__(self, net_g, max_batch_size=16, max_wait_ms=20, bucket_size=8):
+    self.net_g = net_g
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait_ms / 1000.
+    self.bucket_size = bucket_size
+    self.queue = asyncio.Queue()
+    # a single model thread: batches run one after another while new requests queue up
+    self.executor = ThreadPoolExecutor(max_workers=1)
+
+  async def submit(self, text_norm, sid=0, noise_scale=.667, length_scale=1, noise_scale_w=.8, seed=None):
+    future = asyncio.get_event_loop().create_future()
+    await self.queue.put((text_norm, sid, noise_scale, length_scale, noise_scale_w, seed, future))
+    return await future
+
+  async def run(self):
+    loop = asyncio.get_event_loop()
+    while True:
+      batch = [await self.queue.get()]
+      deadline = loop.time() + self.max_wait
+      while len(batch) < self.max_batch_size:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+          break
+        try:
+          batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+        except asyncio.TimeoutError:
+          break
+      try:
+        audios = await loop.run_in_executor(self.executor, self._synthesize, batch)
+      except Exception as e:
+        for *_, future in batch:
+          if not future.done():
+            future.set_exception(e)
+        continue
+      for (*_, future), audio in zip(batch, audios):
+        if not future.done():
+          future.set_result(audio)
+
+  def _synthesize(self, batch):
+    texts, sids, noise_scales, length_scales, noise_scales_w, seeds, _ = zip(*batch)
+    start = time.time()
+    with torch.no_grad():
+      audios = self.net_g.infer_batch(list(texts), sids=list(sids), noise_scale=list(noise_scales),
+          length_scale=list(length_scales), noise_scale_w=list(noise_scales_w), max_batch_size=self.bucket_size,
+          seeds=list(seeds))
+    utils.logger.debug("synthesized batch of %d in %.3fs" % (len(batch), time.time() - start))
+    return audios
+
+
+class SynthesisServer():
+  def __init__(self, net_g, hps, batcher):
+    self.net_g = net_g
+    self.hps = hps
+    self.batcher = batcher
+    # text cleaning (espeak) runs off the event loop, one request at a time
+    self.frontend = ThreadPoolExecutor(max_workers=1)
+
+  async def handle(self, reader, writer):
+    try:
+      request_line = (await reader.readline()).decode("latin-1").split()
+      headers = {}
+      while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+          break
+        k, _, v = line.partition(":")
+        headers[k.strip().lower()] = v.strip()
+      body = await reader.readexactly(int(headers.get("content-length", 0)))
+      if len(request_line) < 2:
+        status, content_type, payload = 400, "application/json", {"error": "bad request"}
+      else:
+        status, content_type, payload = await self.route(request_line[0], request_line[1], body)
+    except Exception as e:
+      utils.logger.exception("request failed")
+      status, content_type, payload = 500, "application/json", {"error": str(e)}
+    if content_type == "application/json":
+      payload = json.dumps(payload).encode("utf-8")
+    writer.write(("HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % (
+        status, {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "Internal Server Error"),
+        content_type, len(payload))).encode("latin-1") + payload)
+    await writer.drain()
+    writer.close()
+
+  async def route(self, method, path, body):
+    if method == "GET" and path == "/health":
+      return 200, "application/json", {"status": "ok"}
+    if method != "POST" or path != "/synthesize":
+      return 404, "application/json", {"error": "not found"}
+    try:
+      req = json.loads(body.decode("utf-8"))
+    except ValueError:
+      req = None
+    if not isinstance(req, dict) or not isinstance(req.get("text"), str):
+      return 400, "application/json", {"error": "expected a JSON object with a string 'text' field"}
+    text = req["text"]
+    sid = req.get("sid", 0)
+    if not isinstance(sid, int) or isinstance(sid, bool) or not 0 <= sid < 2**63:
+      return 400, "application/json", {"error": "sid must be a non-negative integer"}
+    if self.net_g.n_speakers > 0 and not 0 <= sid < self.net_g.n_speakers:
+      return 400, "application/json", {"error": "sid must be in [0, %d)" % self.net_g.n_speakers}
+    seed = req.get("seed")
+    # anything torch.Generator.manual_seed rejects would fail the whole batch it joins
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or not -2**63 <= seed < 2**64):
+      return 400, "application/json", {"error": "seed must be an integer in [-2**63, 2**64)"}
+    scales = {}
+    for name, default in [("noise_scale", .667), ("length_scale", 1), ("noise_scale_w", .8)]:
+      value = req.get(name, default)
+      if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value) or value < 0:
+        return 400, "application/json", {"error": "%s must be a non-negative number" % name}
+      scales[name] = float(value)
+    if scales["length_scale"] == 0:
+      return 400, "application/json", {"error": "length_scale must be positive"}
+    loop = asyncio.get_event_loop()
+    try:
+      text_norm = await loop.run_in_executor(self.frontend, get_text, text, self.hps)
+    except KeyError as e:
+      return 400, "application/json", {"error": "unsupported symbol %s" % e}
+    audio = await self.batcher.submit(text_norm, sid,
+        scales["noise_scale"], scales["length_scale"], scales["noise_scale_w"], seed)
+    return 200, "audio/wav", to_wav_bytes(audio, self.hps.data.sampling_rate)
+
+
+async def serve(args):
+  net_g, hps = load_model(args.config, args.model)
+  if net_g.n_speakers > 0 and args.speaker_cache_size > 0:
+    net_g.enable_speaker_cache(args.speaker_cache_size)
+  if args.text_cache_mb > 0:
+    net_g.enable_text_cache(int(args.text_cache_mb * 2**20))
+  batcher = MicroBatcher(net_g, args.max_batch_size, args.max_wait_ms, args.bucket_size)
+  server = SynthesisServer(net_g, hps, batcher)
+  # the event loop only keeps a weak reference to tasks
+  batcher_task = asyncio.ensure_future(batcher.run())
+  s = await asyncio.start_server(server.handle, args.host, args.port)
+  utils.logger.info("Serving on http://%s:%d" % (args.host, args.port))
+  try:
+    async with s:
+      await s.serve_forever()
+  finally:
+    batcher_task.cancel()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, required=True, help="JSON file for configuration")
+  parser.add_argument("-m", "--model", type=str, required=True, help="Generator checkpoint (G_*.pth)")
+  parser.add_argument("--host", type=str, default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--max_batch_size", type=int, default=16, help="most requests coalesced into one batch")
+  parser.add_argument("--max_wait_ms", type=float, default=20, help="how long a batch waits for more requests")
+  parser.add_argument("--bucket_size", type=int, default=8, help="most utterances per forward pass")
+  parser.add_argument("--speaker_cache_size", type=int, default=256, help="speakers whose conditioning is kept precomputed (0 disables)")
+  parser.add_argument("--text_cache_mb", type=float, default=0, help="memory for cached text encoder outputs of repeated prompts (0 disables)")
+  parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 keeps the default)")
+  args = parser.parse_args()
+  if args.threads > 0:
+    torch.set_num_threads(args.threads)
+  asyncio.run(serve(args))
@@ -52,3 +52,15 @@ def _clean_text(text, cleaner_names):
       raise Exception('Unknown cleaner: %s' % name)
     text = cleaner(text)
   return text
+
+
+def _clean_texts(texts, cleaner_names):
+  '''Runs cleaners over a list of texts, using a cleaner's batched "<name>_batch" variant when it has one.'''
+  texts = list(texts)
+  for name in cleaner_names:
+    cleaner = getattr(cleaners, name + '_batch', None)
+    if cleaner is not None:
+      texts = cleaner(texts)
+    else:
+      texts = [_clean_text(text, [name]) for text in texts]
+  return texts
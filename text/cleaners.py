@@ -12,9 +12,17 @@ hyperparameter. Some cleaners are English-specific. You'll typically want to use
      the symbols in symbols.py to match your data).
 '''
 
+import atexit
+import json
+import os
 import re
+import threading
+from collections import OrderedDict
 from unidecode import unidecode
-from phonemizer import phonemize
+from phonemizer.backend import EspeakBackend
+from phonemizer.separator import default_separator
+
+from utils import save_atomic
 
 
 # Regular expression matching whitespace:
@@ -43,6 +51,119 @@ _abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in
 ]]
 
 
+# Long-lived espeak backends, one per (language, preserve_punctuation, with_stress):
+_backends = {}
+_backend_lock = threading.Lock()
+
+
+class PhonemeCache():
+  '''Bounded LRU cache of phonemizer output keyed on the normalized input text.
+
+  If `path` is given, existing entries are loaded from it and save() writes the
+  cache back (atomically) as JSON.
+  '''
+  def __init__(self, maxsize=10000, path=None):
+    self.maxsize = maxsize
+    self.path = path
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    if path is not None and os.path.exists(path):
+      self.load(path)
+
+  def get(self, key):
+    with self._lock:
+      value = self._entries.get(key)
+      if value is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+        self._entries.move_to_end(key)
+      return value
+
+  def put(self, key, value):
+    if self.maxsize <= 0:
+      return
+    with self._lock:
+      self._entries[key] = value
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def stats(self):
+    with self._lock:
+      total = self.hits + self.misses
+      return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+              'maxsize': self.maxsize, 'hit_rate': self.hits / total if total else 0.}
+
+  def load(self, path):
+    with open(path, encoding='utf-8') as f:
+      entries = json.load(f)
+    for key, value in entries[-self.maxsize:] if self.maxsize > 0 else []:
+      self.put(key, value)
+
+  def save(self, path=None):
+    path = path or self.path
+    if path is None:
+      return
+    with self._lock:
+      entries = list(self._entries.items())
+    save_atomic(path, lambda f: json.dump(entries, f, ensure_ascii=False), mode='w')
+
+
+phoneme_cache = PhonemeCache()
+
+
+def configure_phoneme_cache(maxsize=10000, path=None):
+  '''Replaces the phoneme cache; with a `path` it is loaded from and saved back to disk at exit.'''
+  global phoneme_cache
+  phoneme_cache = PhonemeCache(maxsize, path)
+  if path is not None:
+    atexit.register(phoneme_cache.save)
+  return phoneme_cache
+
+
+def phoneme_cache_stats():
+  return phoneme_cache.stats()
+
+
+def _get_backend(language, preserve_punctuation, with_stress):
+  key = (language, preserve_punctuation, with_stress)
+  if key not in _backends:
+    _backends[key] = EspeakBackend(language, preserve_punctuation=preserve_punctuation, with_stress=with_stress)
+  return _backends[key]
+
+
+def phonemize_cached(texts, language='en-us', preserve_punctuation=False, with_stress=False):
+  '''Phonemizes a list of strings, running espeak once for all of those not found in phoneme_cache.'''
+  cache = phoneme_cache
+  texts = [collapse_whitespace(text).strip() for text in texts]
+  prefix = '%s|%d|%d|' % (language, preserve_punctuation, with_stress)
+  phonemes = [cache.get(prefix + text) for text in texts]
+  # espeak is never asked for empty texts: with preserve_punctuation the
+  # backend drops empty lines, which would shift every later output by one
+  phonemes = ['' if text == '' else p for text, p in zip(texts, phonemes)]
+  missing = sorted(set(text for text, p in zip(texts, phonemes) if p is None))
+  if missing:
+    with _backend_lock:
+      backend = _get_backend(language, preserve_punctuation, with_stress)
+      output = backend.phonemize(missing, separator=default_separator, strip=True)
+    if len(output) != len(missing):
+      raise RuntimeError('phonemizer returned %d outputs for %d texts' % (len(output), len(missing)))
+    results = dict(zip(missing, output))
+    for text, p in results.items():
+      cache.put(prefix + text, p)
+    phonemes = [results[text] if p is None else p for text, p in zip(texts, phonemes)]
+  return phonemes
+
+
 def expand_abbreviations(text):
   for regex, replacement in _abbreviations:
     text = re.sub(regex, replacement, text)
@@ -85,7 +206,7 @@ def english_cleaners(text):
   text = convert_to_ascii(text)
   text = lowercase(text)
   text = expand_abbreviations(text)
-  phonemes = phonemize(text, language='en-us', backend='espeak', strip=True)
+  phonemes = phonemize_cached([text], language='en-us')[0]
   phonemes = collapse_whitespace(phonemes)
   return phonemes
 
@@ -95,6 +216,19 @@ def english_cleaners2(text):
   text = convert_to_ascii(text)
   text = lowercase(text)
   text = expand_abbreviations(text)
-  phonemes = phonemize(text, language='en-us', backend='espeak', strip=True, preserve_punctuation=True, with_stress=True)
+  phonemes = phonemize_cached([text], language='en-us', preserve_punctuation=True, with_stress=True)[0]
   phonemes = collapse_whitespace(phonemes)
   return phonemes
+
+
+def english_cleaners_batch(texts):
+  '''english_cleaners over a list of texts, phonemized in a single backend call.'''
+  texts = [expand_abbreviations(lowercase(convert_to_ascii(text))) for text in texts]
+  return [collapse_whitespace(p) for p in phonemize_cached(texts, language='en-us')]
+
+
+def english_cleaners2_batch(texts):
+  '''english_cleaners2 over a list of texts, phonemized in a single backend call.'''
+  texts = [expand_abbreviations(lowercase(convert_to_ascii(text))) for text in texts]
+  phonemes = phonemize_cached(texts, language='en-us', preserve_punctuation=True, with_stress=True)
+  return [collapse_whitespace(p) for p in phonemes]
@@ -17,6 +17,7 @@ import commons
 import utils
 from data_utils import (
   TextAudioSpeakerLoader,
+  PackedTextAudioSpeakerLoader,
   TextAudioSpeakerCollate,
   DistributedBucketSampler
 )
@@ -50,6 +51,13 @@ def main():
   mp.spawn(run, nprocs=n_gpus, args=(n_gpus, hps,))
 
 
+def load_dataset(path, hparams):
+  # a directory is a pack written by pack_dataset.py
+  if os.path.isdir(path):
+    return PackedTextAudioSpeakerLoader(path, hparams)
+  return TextAudioSpeakerLoader(path, hparams)
+
+
 def run(rank, n_gpus, hps):
   global global_step
   if rank == 0:
@@ -58,12 +66,16 @@ def run(rank, n_gpus, hps):
     utils.check_git_hash(hps.model_dir)
     writer = SummaryWriter(log_dir=hps.model_dir)
     writer_eval = SummaryWriter(log_dir=os.path.join(hps.model_dir, "eval"))
+    # keep_last_checkpoints=0 keeps every checkpoint
+    saver = utils.AsyncCheckpointSaver(
+        getattr(hps.train, "keep_last_checkpoints", 0),
+        getattr(hps.train, "keep_every_checkpoints", 0))
 
   dist.init_process_group(backend='nccl', init_method='env://', world_size=n_gpus, rank=rank)
   torch.manual_seed(hps.train.seed)
   torch.cuda.set_device(rank)
 
-  train_dataset = TextAudioSpeakerLoader(hps.data.training_files, hps.data)
+  train_dataset = load_dataset(hps.data.training_files, hps.data)
   train_sampler = DistributedBucketSampler(
       train_dataset,
       hps.train.batch_size,
@@ -71,11 +83,12 @@ def run(rank, n_gpus, hps):
       num_replicas=n_gpus,
       rank=rank,
       shuffle=True)
-  collate_fn = TextAudioSpeakerCollate()
+  # train.collate_buffers > 0 recycles batch buffers in each loader worker, see data_utils.CollateBuffers
+  collate_fn = TextAudioSpeakerCollate(buffer_depth=getattr(hps.train, "collate_buffers", 0))
   train_loader = DataLoader(train_dataset, num_workers=8, shuffle=False, pin_memory=True,
       collate_fn=collate_fn, batch_sampler=train_sampler)
   if rank == 0:
-    eval_dataset = TextAudioSpeakerLoader(hps.data.validation_files, hps.data)
+    eval_dataset = load_dataset(hps.data.validation_files, hps.data)
     eval_loader = DataLoader(eval_dataset, num_workers=8, shuffle=False,
         batch_size=hps.train.batch_size, pin_memory=True,
         drop_last=False, collate_fn=collate_fn)
@@ -113,16 +126,21 @@ def run(rank, n_gpus, hps):
 
   scaler = GradScaler(enabled=hps.train.fp16_run)
 
-  for epoch in range(epoch_str, hps.train.epochs + 1):
-    if rank==0:
-      train_and_evaluate(rank, epoch, hps, [net_g, net_d], [optim_g, optim_d], [scheduler_g, scheduler_d], scaler, [train_loader, eval_loader], logger, [writer, writer_eval])
-    else:
-      train_and_evaluate(rank, epoch, hps, [net_g, net_d], [optim_g, optim_d], [scheduler_g, scheduler_d], scaler, [train_loader, None], None, None)
-    scheduler_g.step()
-    scheduler_d.step()
-
-
-def train_and_evaluate(rank, epoch, hps, nets, optims, schedulers, scaler, loaders, logger, writers):
+  try:
+    for epoch in range(epoch_str, hps.train.epochs + 1):
+      if rank==0:
+        train_and_evaluate(rank, epoch, hps, [net_g, net_d], [optim_g, optim_d], [scheduler_g, scheduler_d], scaler, [train_loader, eval_loader], logger, [writer, writer_eval], saver)
+      else:
+        train_and_evaluate(rank, epoch, hps, [net_g, net_d], [optim_g, optim_d], [scheduler_g, scheduler_d], scaler, [train_loader, None], None, None)
+      scheduler_g.step()
+      scheduler_d.step()
+  finally:
+    if rank == 0:
+      # also on errors, so the checkpoint writer never keeps the process alive
+      saver.close()
+
+
+def train_and_evaluate(rank, epoch, hps, nets, optims, schedulers, scaler, loaders, logger, writers, saver=None):
   net_g, net_d = nets
   optim_g, optim_d = optims
   scheduler_g, scheduler_d = schedulers
@@ -224,8 +242,11 @@ def train_and_evaluate(rank, epoch, hps, nets, optims, schedulers, scaler, loade
 
       if global_step % hps.train.eval_interval == 0:
         evaluate(hps, net_g, eval_loader, writer_eval)
-        utils.save_checkpoint(net_g, optim_g, hps.train.learning_rate, epoch, os.path.join(hps.model_dir, "G_{}.pth".format(global_step)))
-        utils.save_checkpoint(net_d, optim_d, hps.train.learning_rate, epoch, os.path.join(hps.model_dir, "D_{}.pth".format(global_step)))
+        save = saver.save if saver is not None else utils.save_checkpoint
+        save(net_g, optim_g, hps.train.learning_rate, epoch, os.path.join(hps.model_dir, "G_{}.pth".format(global_step)))
+        save(net_d, optim_d, hps.train.learning_rate, epoch, os.path.join(hps.model_dir, "D_{}.pth".format(global_step)))
+        if saver is not None and not getattr(hps.train, "async_checkpoint", True):
+          saver.wait()
     global_step += 1
   
   if rank == 0:
@@ -1,10 +1,15 @@
 import os
+import atexit
 import glob
+import inspect
 import sys
 import argparse
 import logging
 import json
+import queue
+import re
 import subprocess
+import threading
 import numpy as np
 from scipy.io.wavfile import read
 import torch
@@ -17,12 +22,18 @@ logger = logging
 
 def load_checkpoint(checkpoint_path, model, optimizer=None):
   assert os.path.isfile(checkpoint_path)
-  checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
+  if is_mapped_checkpoint(checkpoint_path):
+    checkpoint_dict = load_mapped_checkpoint(checkpoint_path)
+  else:
+    checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
   iteration = checkpoint_dict['iteration']
   learning_rate = checkpoint_dict['learning_rate']
   if optimizer is not None:
     optimizer.load_state_dict(checkpoint_dict['optimizer'])
   saved_state_dict = checkpoint_dict['model']
+  if checkpoint_dict.get('frozen', False):
+    # inference checkpoints written by freeze.py hold folded weights only
+    (model.module if hasattr(model, 'module') else model).freeze_for_inference()
   if hasattr(model, 'module'):
     state_dict = model.module.state_dict()
   else:
@@ -34,10 +45,15 @@ def load_checkpoint(checkpoint_path, model, optimizer=None):
     except:
       logger.info("%s is not in the checkpoint" % k)
       new_state_dict[k] = v
+  kwargs = {}
+  if (checkpoint_dict.get('mapped', False) and 'assign' in inspect.signature(model.load_state_dict).parameters
+      and all(v.device.type == 'cpu' for v in state_dict.values())):
+    # keep the memory-mapped tensors instead of copying them into the model's
+    kwargs['assign'] = True
   if hasattr(model, 'module'):
-    model.module.load_state_dict(new_state_dict)
+    model.module.load_state_dict(new_state_dict, **kwargs)
   else:
-    model.load_state_dict(new_state_dict)
+    model.load_state_dict(new_state_dict, **kwargs)
   logger.info("Loaded checkpoint '{}' (iteration {})" .format(
     checkpoint_path, iteration))
   return model, optimizer, learning_rate, iteration
@@ -50,10 +66,191 @@ def save_checkpoint(model, optimizer, learning_rate, iteration, checkpoint_path)
     state_dict = model.module.state_dict()
   else:
     state_dict = model.state_dict()
-  torch.save({'model': state_dict,
-              'iteration': iteration,
-              'optimizer': optimizer.state_dict(),
-              'learning_rate': learning_rate}, checkpoint_path)
+  checkpoint = {'model': state_dict,
+                'iteration': iteration,
+                'optimizer': optimizer.state_dict() if optimizer is not None else None,
+                'learning_rate': learning_rate}
+  save_atomic(checkpoint_path, lambda f: torch.save(checkpoint, f))
+
+
+def save_atomic(path, save_fn, mode='wb'):
+  """Writes through save_fn(file) into a temporary file next to `path`, then
+  renames it into place, so readers never see a partial file and an
+  interrupted write leaves a .tmp file behind instead of a truncated one.
+  Text modes write UTF-8."""
+  os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+  tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+  with open(tmp_path, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+    save_fn(f)
+  os.replace(tmp_path, path)
+
+
+def _to_cpu(obj):
+  if isinstance(obj, torch.Tensor):
+    return obj.detach().to('cpu', copy=True)
+  if isinstance(obj, dict):
+    return {k: _to_cpu(v) for k, v in obj.items()}
+  if isinstance(obj, (list, tuple)):
+    return type(obj)(_to_cpu(v) for v in obj)
+  return obj
+
+
+def checkpoint_step(checkpoint_path):
+  """The number in a checkpoint file name such as G_1000.pth."""
+  digits = re.findall(r'\d+', os.path.basename(checkpoint_path))
+  return int(digits[-1]) if digits else None
+
+
+def prune_checkpoints(dir_path, regex="G_*.pth", keep_last=0, keep_every=0):
+  """Deletes checkpoints matching `regex` except the `keep_last` newest and
+  those whose step is a multiple of `keep_every`. keep_last=0 keeps all."""
+  if keep_last <= 0:
+    return []
+  f_list = [f for f in glob.glob(os.path.join(dir_path, regex)) if checkpoint_step(f) is not None]
+  f_list.sort(key=checkpoint_step)
+  removed = []
+  for f in f_list[:-keep_last]:
+    if keep_every > 0 and checkpoint_step(f) % keep_every == 0:
+      continue
+    os.remove(f)
+    removed.append(f)
+  return removed
+
+
+class AsyncCheckpointSaver():
+  """Saves checkpoints from a background thread.
+
+  save() copies the state dicts to CPU on the calling thread and returns; the
+  write (to a .tmp file, then renamed) and pruning with prune_checkpoints
+  happen in the background. At most one snapshot waits to be written, so a
+  save() issued while the previous one is still pending blocks until it
+  starts.
+  """
+  def __init__(self, keep_last=0, keep_every=0):
+    self.keep_last = keep_last
+    self.keep_every = keep_every
+    self.queue = queue.Queue(maxsize=1)
+    self.error = None
+    self.closed = False
+    # daemon, so an exception in training cannot leave the process waiting on
+    # the queue; the pending write is still flushed by close() at exit
+    self.thread = threading.Thread(target=self._run, daemon=True)
+    self.thread.start()
+    atexit.register(self.close)
+
+  def save(self, model, optimizer, learning_rate, iteration, checkpoint_path):
+    if self.error is not None:
+      raise RuntimeError("previous checkpoint write failed") from self.error
+    logger.info("Saving model and optimizer state at iteration {} to {}".format(
+      iteration, checkpoint_path))
+    if hasattr(model, 'module'):
+      state_dict = model.module.state_dict()
+    else:
+      state_dict = model.state_dict()
+    state = _to_cpu({'model': state_dict,
+                     'iteration': iteration,
+                     'optimizer': optimizer.state_dict() if optimizer is not None else None,
+                     'learning_rate': learning_rate})
+    self.queue.put((state, checkpoint_path))
+
+  def _run(self):
+    while True:
+      item = self.queue.get()
+      try:
+        if item is None:
+          return
+        state, checkpoint_path = item
+        save_atomic(checkpoint_path, lambda f: torch.save(state, f))
+        # prune siblings of the same kind, e.g. G_*.pth for G_1000.pth
+        regex = re.sub(r'\d+', '*', os.path.basename(checkpoint_path))
+        for f in prune_checkpoints(os.path.dirname(checkpoint_path), regex, self.keep_last, self.keep_every):
+          logger.info("Removed old checkpoint {}".format(f))
+      except Exception as e:
+        logger.exception("Saving {} failed".format(item[1]))
+        self.error = e
+      finally:
+        self.queue.task_done()
+
+  def wait(self):
+    """Blocks until every queued checkpoint is written."""
+    self.queue.join()
+
+  def close(self):
+    if self.closed:
+      return
+    self.closed = True
+    self.queue.put(None)
+    self.thread.join()
+
+
+MAPPED_MAGIC = b'VITSMAP1'
+MAPPED_ALIGNMENT = 64
+
+
+def _align(n, alignment=MAPPED_ALIGNMENT):
+  return (n + alignment - 1) // alignment * alignment
+
+
+def save_mapped_checkpoint(state_dict, checkpoint_path, config=None, iteration=0, learning_rate=None, frozen=True):
+  """Writes an inference checkpoint that load_mapped_checkpoint can map without deserializing.
+
+  Layout: MAPPED_MAGIC, the header length as little-endian uint64, a JSON
+  header (config, iteration, and dtype/shape/offset per tensor), then the raw
+  tensor bytes, each aligned to MAPPED_ALIGNMENT from the start of the file.
+  """
+  tensors = {}
+  offset = 0
+  for k, v in state_dict.items():
+    nbytes = v.numel() * v.element_size()
+    tensors[k] = {'dtype': str(v.dtype).replace('torch.', ''), 'shape': list(v.shape), 'offset': offset, 'nbytes': nbytes}
+    offset = _align(offset + nbytes)
+  header = json.dumps({'format': 1, 'config': config, 'iteration': iteration, 'learning_rate': learning_rate,
+                       'frozen': frozen, 'tensors': tensors}).encode('utf-8')
+  data_start = _align(len(MAPPED_MAGIC) + 8 + len(header))
+
+  def write(f):
+    f.write(MAPPED_MAGIC)
+    f.write(np.uint64(len(header)).tobytes())
+    f.write(header)
+    for k, v in state_dict.items():
+      f.seek(data_start + tensors[k]['offset'])
+      f.write(v.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+    f.truncate(data_start + offset)
+  save_atomic(checkpoint_path, write)
+
+
+def is_mapped_checkpoint(checkpoint_path):
+  with open(checkpoint_path, 'rb') as f:
+    return f.read(len(MAPPED_MAGIC)) == MAPPED_MAGIC
+
+
+def load_mapped_checkpoint(checkpoint_path):
+  """Maps a checkpoint written by save_mapped_checkpoint.
+
+  Tensors are views of a copy-on-write memory map, so loading costs page
+  faults instead of deserialization and unmodified pages are shared between
+  processes. Returns a dict shaped like the torch.load() result of
+  save_checkpoint, plus 'config' (the embedded config dict or None) and
+  'mapped': True.
+  """
+  with open(checkpoint_path, 'rb') as f:
+    assert f.read(len(MAPPED_MAGIC)) == MAPPED_MAGIC, '%s is not a mapped checkpoint' % checkpoint_path
+    header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+    header = json.loads(f.read(header_len).decode('utf-8'))
+  data_start = _align(len(MAPPED_MAGIC) + 8 + header_len)
+  buf = np.memmap(checkpoint_path, dtype=np.uint8, mode='c')
+  state_dict = {}
+  for k, t in header['tensors'].items():
+    start = data_start + t['offset']
+    data = torch.from_numpy(buf[start:start + t['nbytes']])
+    state_dict[k] = data.view(getattr(torch, t['dtype'])).view(t['shape'])
+  return {'model': state_dict,
+          'iteration': header['iteration'],
+          'optimizer': None,
+          'learning_rate': header['learning_rate'],
+          'frozen': header['frozen'],
+          'config': header['config'],
+          'mapped': True}
 
 
 def summarize(writer, global_step, scalars={}, histograms={}, images={}, audios={}, audio_sampling_rate=22050):
@@ -0,0 +1,192 @@
+"""Multi-process CPU inference with one copy of the weights in shared memory.
+
+The parent loads and freezes the model once and moves its parameters to
+shared memory; workers are forked (or spawned, receiving the shared
+storages by handle) and each runs torch with its own intra-op thread count,
+optionally pinned to its own cores. Requests are pulled from one queue, so
+an idle worker always takes the next one.
+
+python worker_pool.py -c configs/ljs_base.json -m /path/to/pretrained_ljs.pth --layouts 1x8 2x4 4x2 8x1
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.multiprocessing as mp
+
+import commons
+
+
+def _worker(rank, net_g, requests, results, num_threads, cores):
+  torch.set_num_threads(num_threads)
+  if cores:
+    os.sched_setaffinity(0, cores)
+  with torch.no_grad():
+    while True:
+      item = requests.get()
+      if item is None:
+        break
+      request_id, text_norm, sid, noise_scale, length_scale, noise_scale_w, seed = item
+      start = time.perf_counter()
+      try:
+        x = torch.LongTensor(text_norm).unsqueeze(0)
+        x_lengths = torch.LongTensor([x.size(1)])
+        sid = None if sid is None else torch.LongTensor([sid])
+        generators = None if seed is None else commons.make_generators([seed])
+        audio = net_g.infer(x, x_lengths, sid=sid, noise_scale=noise_scale, length_scale=length_scale,
+            noise_scale_w=noise_scale_w, generators=generators)[0][0, 0].numpy()
+        results.put((request_id, rank, audio, time.perf_counter() - start, None))
+      except Exception as e:
+        results.put((request_id, rank, None, time.perf_counter() - start, repr(e)))
+
+
+class InferencePool():
+  """Runs SynthesizerTrn.infer in `num_workers` processes sharing one copy of the weights.
+
+  net_g should already be frozen and in eval mode; its parameters are moved
+  to shared memory in place. With `pin_cores`, worker i is restricted to
+  the i-th group of `threads_per_worker` cores (wrapping around).
+  """
+  def __init__(self, net_g, sampling_rate, num_workers=2, threads_per_worker=1, pin_cores=False, start_method="fork"):
+    self.sampling_rate = sampling_rate
+    self.num_workers = num_workers
+    net_g.share_memory()
+    ctx = mp.get_context(start_method)
+    self.requests = ctx.Queue()
+    self.results = ctx.Queue()
+    available = sorted(os.sched_getaffinity(0)) if pin_cores else []
+    self.workers = []
+    for rank in range(num_workers):
+      cores = [available[(rank * threads_per_worker + i) % len(available)] for i in range(threads_per_worker)] if pin_cores else []
+      p = ctx.Process(target=_worker, args=(rank, net_g, self.requests, self.results, threads_per_worker, cores),
+          daemon=True)
+      p.start()
+      self.workers.append(p)
+    self._futures = {}
+    self._lock = threading.Lock()
+    self._next_id = 0
+    self.reset_stats()
+    self._collector = threading.Thread(target=self._collect, daemon=True)
+    self._collector.start()
+
+  def submit(self, text_norm, sid=None, noise_scale=.667, length_scale=1, noise_scale_w=.8, seed=None):
+    """Queues one utterance (phoneme ids) and returns a Future of its 1-D float32 waveform."""
+    future = Future()
+    with self._lock:
+      request_id = self._next_id
+      self._next_id += 1
+      self._futures[request_id] = (future, time.perf_counter())
+    self.requests.put((request_id, [int(i) for i in text_norm], sid, noise_scale, length_scale, noise_scale_w, seed))
+    return future
+
+  def map(self, texts, **kwargs):
+    return [f.result() for f in [self.submit(text_norm, **kwargs) for text_norm in texts]]
+
+  def _collect(self):
+    while True:
+      item = self.results.get()
+      if item is None:
+        break
+      request_id, rank, audio, compute, error = item
+      with self._lock:
+        future, submitted = self._futures.pop(request_id)
+        if error is None:
+          self._latencies.append(time.perf_counter() - submitted)
+          self._compute.append(compute)
+          self._audio_seconds += audio.shape[0] / self.sampling_rate
+          self._per_worker[rank] += 1
+      if error is None:
+        future.set_result(audio)
+      else:
+        future.set_exception(RuntimeError("worker %d: %s" % (rank, error)))
+
+  def reset_stats(self):
+    with self._lock:
+      self._start = time.perf_counter()
+      self._latencies = []
+      self._compute = []
+      self._audio_seconds = 0.
+      self._per_worker = [0] * self.num_workers
+
+  def stats(self):
+    """Throughput and latency over the requests completed since reset_stats()."""
+    with self._lock:
+      latencies = sorted(self._latencies)
+      wall = time.perf_counter() - self._start
+      n = len(latencies)
+      if n == 0:
+        return {"requests": 0}
+      pct = lambda q: latencies[min(n - 1, int(q * n))]
+      return {
+        "requests": n,
+        "wall": wall,
+        "requests_per_second": n / wall,
+        "audio_seconds_per_second": self._audio_seconds / wall,
+        "latency_p50": pct(.5),
+        "latency_p95": pct(.95),
+        "latency_p99": pct(.99),
+        "compute_mean": statistics.mean(self._compute),
+        "per_worker": list(self._per_worker)}
+
+  def close(self):
+    for _ in self.workers:
+      self.requests.put(None)
+    for p in self.workers:
+      p.join()
+    self.results.put(None)
+    self._collector.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+if __name__ == "__main__":
+  from benchmark import build_model
+  from inference import load_model
+  from quantize import load_items
+  from text.symbols import symbols
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", type=str, required=True, help="JSON file for configuration")
+  parser.add_argument("-m", "--model", type=str, default=None, help="Generator checkpoint (random weights if omitted)")
+  parser.add_argument("--layouts", nargs="+", default=["1x1"], help="workers x threads per worker, e.g. 2x4 8x1")
+  parser.add_argument("--pin_cores", action="store_true", help="give each worker its own cores")
+  parser.add_argument("--start_method", choices=["fork", "spawn", "forkserver"], default="fork")
+  parser.add_argument("--filelist", type=str, default=None, help="take utterances from a filelist instead of random ids")
+  parser.add_argument("--length", type=int, default=100, help="phoneme ids per random utterance")
+  parser.add_argument("--requests", type=int, default=32)
+  parser.add_argument("--warmup", type=int, default=1, help="requests per worker before measuring")
+  args = parser.parse_args()
+
+  if args.model is not None:
+    net_g, hps = load_model(args.config, args.model)
+  else:
+    net_g, hps = build_model(args.config, freeze=False)
+  net_g.freeze_for_inference()
+  if args.filelist is not None:
+    items = load_items(args.filelist, hps, args.requests)
+  else:
+    g = torch.Generator().manual_seed(1234)
+    sid = 0 if hps.data.n_speakers > 0 else None
+    items = [(torch.randint(1, len(symbols), (args.length,), generator=g), sid) for _ in range(args.requests)]
+
+  print("%7s %8s %9s %9s %9s %9s %9s  %s" % ("layout", "req/s", "audio x", "p50(s)", "p95(s)", "p99(s)", "compute", "per worker"))
+  for layout in args.layouts:
+    num_workers, threads = [int(v) for v in layout.split("x")]
+    with InferencePool(net_g, hps.data.sampling_rate, num_workers, threads, args.pin_cores, args.start_method) as pool:
+      for f in [pool.submit(items[i % len(items)][0], items[i % len(items)][1]) for i in range(args.warmup * num_workers)]:
+        f.result()
+      pool.reset_stats()
+      futures = [pool.submit(text_norm, sid, seed=i) for i, (text_norm, sid) in enumerate(items)]
+      for f in futures:
+        f.result()
+      s = pool.stats()
+    print("%7s %8.2f %9.2f %9.3f %9.3f %9.3f %9.3f  %s" % (layout, s["requests_per_second"], s["audio_seconds_per_second"],
+        s["latency_p50"], s["latency_p95"], s["latency_p99"], s["compute_mean"], s["per_worker"]))